@@ -180,7 +180,7 @@ source "$VENV_DIR/bin/activate"
 if ! python - <<'PY'
 import importlib.util
 
-required_modules = ("openai", "termcolor", "distro", "prompt_toolkit")
+required_modules = ("openai", "httpx", "termcolor", "distro", "prompt_toolkit", "orjson")
 missing = [name for name in required_modules if importlib.util.find_spec(name) is None]
 if missing:
     print("[prompt2shell] Missing Python modules: " + ", ".join(missing))
@@ -202,13 +202,13 @@ fi
 
 if [ "$UPDATE_REQUIREMENTS" -eq 1 ]; then
   echo "[prompt2shell] Upgrading core packages in virtualenv"
-  python -m pip install --upgrade openai termcolor distro prompt_toolkit
+  python -m pip install --upgrade openai httpx termcolor distro prompt_toolkit orjson
   echo "[prompt2shell] Writing pinned versions to requirements.txt"
   P2S_REQ_FILE="$REQ_FILE" python - <<'PY'
 import os
 from importlib.metadata import version
 
-packages = ("openai", "termcolor", "distro", "prompt_toolkit")
+packages = ("openai", "httpx", "termcolor", "distro", "prompt_toolkit", "orjson")
 req_file = os.environ["P2S_REQ_FILE"]
 lines = [f"{name}=={version(name)}" for name in packages]
 with open(req_file, "w", encoding="utf-8") as handle:
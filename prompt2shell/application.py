@@ -1,18 +1,245 @@
+import atexit
+import os
+import queue
 import subprocess
 import sys
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from os.path import exists as _path_exists
+from os.path import expanduser
 
 from prompt_toolkit import ANSI, PromptSession
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.history import FileHistory
+from prompt_toolkit.history import FileHistory, ThreadedHistory
 from prompt_toolkit.input.defaults import create_input
 from prompt_toolkit.output.defaults import create_output
 
 from .common import APP_NAME, colored, env_flag
 
 
+def _style_affixes(color):
+    """Returns the ANSI prefix/suffix that `colored` wraps around text for a color."""
+    prefix, _, suffix = colored("\0", color).partition("\0")
+    return prefix, suffix
+
+
+@dataclass(frozen=True)
+class _StyledStrings:
+    """ANSI-wrapped UI strings rendered once instead of on every prompt."""
+
+    commands_header: str
+    command_prefix: str
+    command_suffix: str
+    description_prefix: str
+    description_suffix: str
+    prompt_prefix: str
+    prompt_suffix: str
+    edit_prompt: ANSI
+    strict_action_prompt: ANSI
+    safe_action_prompt: ANSI
+    yes_no_hint: str
+    thinking_label: str
+    error_prefix: str
+    error_suffix: str
+    exiting: str
+
+    @classmethod
+    def build(cls):
+        command_prefix, command_suffix = _style_affixes("blue")
+        description_prefix, description_suffix = _style_affixes("grey")
+        prompt_prefix, prompt_suffix = _style_affixes("green")
+        error_prefix, error_suffix = _style_affixes("red")
+        return cls(
+            commands_header=colored("\nProposed commands:", "green"),
+            command_prefix=command_prefix,
+            command_suffix=command_suffix,
+            description_prefix=description_prefix,
+            description_suffix=description_suffix,
+            prompt_prefix=prompt_prefix,
+            prompt_suffix=prompt_suffix,
+            edit_prompt=ANSI(colored("Enter the modified command: ", "cyan")),
+            strict_action_prompt=ANSI(colored("Strict safe mode action [e=edit, s=skip] (default s): ", "yellow")),
+            safe_action_prompt=ANSI(
+                colored("Safe mode action [run=execute once, e=edit, s=skip] (default s): ", "yellow")
+            ),
+            yes_no_hint=colored("Please answer with y or n.", "yellow"),
+            thinking_label=colored("Thinking...", "cyan"),
+            error_prefix=error_prefix,
+            error_suffix=error_suffix,
+            exiting=colored("Exiting...", "yellow"),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class CommandSpec:
+    """A proposed command with whitespace already stripped from its fields."""
+
+    command: str
+    description: str
+
+    @classmethod
+    def from_payload(cls, item):
+        return cls(item.get("command", "").strip(), item.get("description", "").strip())
+
+
+# Safe-mode guard states: how a blocked command is reported and which answers
+# the follow-up prompt accepts (anything else skips the command).
+_SAFE_MODE_GUARD_POLICIES = {
+    "strict": {
+        "warning": "Strict safe mode blocked command",
+        "event": "strict_safe_mode_blocked_command",
+        "prompt": "strict_action_prompt",
+        "actions": {"e": "edit", "edit": "edit"},
+        "skip_reason": "blocked_by_strict_safe_mode",
+    },
+    "destructive": {
+        "warning": "Safe mode blocked high-risk command",
+        "event": "safe_mode_blocked_command",
+        "prompt": "safe_action_prompt",
+        "actions": {"run": "run", "r": "run", "e": "edit", "edit": "edit"},
+        "skip_reason": "blocked_by_safe_mode",
+    },
+}
+
+# Answers accepted at the per-command prompt, mapped to the canonical action.
+_COMMAND_ACTION_ALIASES = {
+    "": "s",
+    "r": "r",
+    "e": "e",
+    "s": "s",
+    "a": "a",
+    "q": "q",
+    "y": "r",
+    "n": "s",
+}
+
+# Delay before the progress indicator appears, so fast calls never flash it.
+_PROGRESS_DELAY_SECONDS = 0.3
+_PROGRESS_INTERVAL_SECONDS = 0.1
+
+
+class _ProgressIndicator:
+    """Renders a one-line spinner on a TTY while a background call is in flight."""
+
+    FRAMES = "|/-\\"
+
+    def __init__(self, label, stream=None):
+        self.label = label
+        self.stream = stream if stream is not None else sys.stdout
+        self._frame = 0
+        self._visible = False
+        self._suspended = False
+        # tick() runs on the UI thread while suspend() may be called from the
+        # worker thread that starts streaming text onto the same line.
+        self._lock = threading.Lock()
+
+    def _enabled(self):
+        try:
+            return self.stream.isatty()
+        except (AttributeError, ValueError):
+            return False
+
+    def tick(self):
+        if not self._enabled():
+            return
+        with self._lock:
+            if self._suspended:
+                return
+            frame = self.FRAMES[self._frame % len(self.FRAMES)]
+            self._frame += 1
+            self.stream.write(f"\r{self.label} {frame}")
+            self.stream.flush()
+            self._visible = True
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def suspend(self):
+        """Clears the spinner for good so streamed output can take over the line."""
+        with self._lock:
+            self._suspended = True
+            self._clear_locked()
+
+    def _clear_locked(self):
+        if not self._visible:
+            return
+        self.stream.write("\r\x1b[K")
+        self.stream.flush()
+        self._visible = False
+
+
+class _StreamEcho:
+    """Writes assistant text deltas to the terminal as the response streams in."""
+
+    __slots__ = ("indicator", "started", "cancelled")
+
+    def __init__(self, indicator):
+        self.indicator = indicator
+        self.started = False
+        self.cancelled = False
+
+    def cancel(self):
+        """Silences deltas still arriving from an abandoned call."""
+        self.cancelled = True
+
+    def __call__(self, delta):
+        if self.cancelled:
+            return
+        if not self.started:
+            self.indicator.suspend()
+            self.started = True
+        sys.stdout.write(colored(delta, "magenta"))
+        sys.stdout.flush()
+
+    def finish(self):
+        """Ends the streamed line; returns True when any text was shown."""
+        if self.started:
+            sys.stdout.write("\n")
+        return self.started
+
+
+# Runtime toggles typed at the REPL prompt: command -> (setting, enabled), where
+# enabled=None only reports the current status. Both bare and "/"-prefixed forms work.
+_RUNTIME_COMMAND_TABLE = {
+    "safe": ("safe", None),
+    "safe on": ("safe", True),
+    "safe off": ("safe", False),
+    "strict": ("strict", None),
+    "strict on": ("strict", True),
+    "strict off": ("strict", False),
+    "tokens": ("tokens", None),
+    "tokens on": ("tokens", True),
+    "tokens off": ("tokens", False),
+    "batch": ("batch", None),
+    "batch on": ("batch", True),
+    "batch off": ("batch", False),
+}
+_RUNTIME_COMMANDS = {
+    alias: entry
+    for name, entry in _RUNTIME_COMMAND_TABLE.items()
+    for alias in (name, f"/{name}")
+}
+
+
 class Application:
     """Main application class."""
 
+    __slots__ = (
+        "openai_helper",
+        "command_helper",
+        "interaction_logger",
+        "safe_mode_enabled",
+        "safe_mode_strict",
+        "show_tokens",
+        "stream_responses",
+        "batch_analysis",
+        "max_report_chars",
+        "session",
+        "_styles",
+    )
+
     def __init__(self, openai_helper, command_helper, interaction_logger):
         """Initializes the application."""
         self.openai_helper = openai_helper
@@ -21,6 +248,10 @@ class Application:
         self.safe_mode_enabled = self._read_safe_mode_from_env()
         self.safe_mode_strict = self._read_safe_mode_strict_from_env()
         self.show_tokens = self._read_show_tokens_from_env()
+        self.stream_responses = self._read_stream_responses_from_env()
+        self.batch_analysis = self._read_batch_analysis_from_env()
+        self.max_report_chars = self._read_max_report_chars_from_env()
+        self._styles = _StyledStrings.build()
 
         default_history_path = FileHistoryPath.default()
         legacy_history_path = FileHistoryPath.legacy()
@@ -33,7 +264,7 @@ class Application:
         prompt_input = create_input(always_prefer_tty=True)
         prompt_output = create_output(always_prefer_tty=True)
         self.session = PromptSession(
-            history=FileHistory(history_path),
+            history=ThreadedHistory(BackgroundFileHistory(history_path)),
             auto_suggest=AutoSuggestFromHistory(),
             input=prompt_input,
             output=prompt_output,
@@ -51,6 +282,23 @@ class Application:
     def _read_show_tokens_from_env():
         return env_flag("PROMPT2SHELL_SHOW_TOKENS", True)
 
+    @staticmethod
+    def _read_stream_responses_from_env():
+        return env_flag("PROMPT2SHELL_STREAM", True)
+
+    @staticmethod
+    def _read_batch_analysis_from_env():
+        return env_flag("PROMPT2SHELL_BATCH_ANALYSIS", False)
+
+    @staticmethod
+    def _read_max_report_chars_from_env():
+        raw_value = os.getenv("PROMPT2SHELL_MAX_REPORT_CHARS", "20000")
+        try:
+            max_chars = int(raw_value)
+        except (TypeError, ValueError):
+            max_chars = 20000
+        return max_chars if max_chars > 0 else None
+
     def _safe_mode_status_text(self):
         return "ON" if self.safe_mode_enabled else "OFF"
 
@@ -75,6 +323,14 @@ class Application:
         self._sync_openai_session_context()
         self.interaction_logger.log_event("safe_mode_strict_changed", {"enabled": enabled})
 
+    def _batch_analysis_status_text(self):
+        return "ON" if self.batch_analysis else "OFF"
+
+    def _set_batch_analysis(self, enabled):
+        self.batch_analysis = enabled
+        print(colored(f"Batch analysis: {self._batch_analysis_status_text()}", "green" if enabled else "yellow"))
+        self.interaction_logger.log_event("batch_analysis_changed", {"enabled": enabled})
+
     def _set_show_tokens(self, enabled):
         self.show_tokens = enabled
         print(colored(f"Token usage display: {self._show_tokens_status_text()}", "green" if enabled else "yellow"))
@@ -84,29 +340,16 @@ class Application:
         if not self.show_tokens:
             return
 
-        usage = self.openai_helper.get_last_usage_summary()
-        if usage is None:
+        usage_line = self.openai_helper.format_usage_line()
+        if usage_line is None:
             return
+        print(colored(usage_line, "cyan"))
 
-        session_usage = self.openai_helper.get_session_usage_summary()
-        max_output_tokens = self.openai_helper.max_output_tokens
-        output_left = max(0, max_output_tokens - usage.get("output_tokens", 0))
-
-        usage_text = (
-            f"Tokens last: in={usage.get('input_tokens', 0)}, "
-            f"out={usage.get('output_tokens', 0)}, total={usage.get('total_tokens', 0)}, "
-            f"out_left={output_left}/{max_output_tokens} | "
-            f"session: in={session_usage.get('input_tokens', 0)}, "
-            f"out={session_usage.get('output_tokens', 0)}, "
-            f"total={session_usage.get('total_tokens', 0)}, "
-            f"calls={session_usage.get('api_calls', 0)}"
-        )
-        print(colored(usage_text, "cyan"))
-
-    def _print_assistant_response(self, response):
-        if not isinstance(response, str) or response.strip() == "":
+    def _print_assistant_response(self, response, already_shown=False):
+        if not isinstance(response, str) or not response or response.isspace():
             return
-        print(colored(response, "magenta"))
+        if not already_shown:
+            print(colored(response, "magenta"))
         self.interaction_logger.log("assistant", response)
 
     def _sync_openai_session_context(self):
@@ -118,27 +361,130 @@ class Application:
             strict_safe_mode=self.safe_mode_strict,
         )
 
+    def _limit_report_output(self, output):
+        """Caps stdout/stderr sent to the assistant; the terminal already showed the full output."""
+        limit = self.max_report_chars
+        if limit is None or not isinstance(output, dict):
+            return output
+
+        limited = output
+        original_sizes = {}
+        for key in ("stdout", "stderr"):
+            text = output.get(key)
+            if not isinstance(text, str) or len(text) <= limit:
+                continue
+            if limited is output:
+                limited = dict(output)
+            limited[key] = self.command_helper.truncate_text(text, limit)
+            original_sizes[key] = len(text)
+
+        if original_sizes:
+            self.interaction_logger.log_event(
+                "output_truncated",
+                {"command": output.get("command"), "original_chars": original_sizes, "limit": limit},
+            )
+        return limited
+
+    def _call_openai(self, func, *args, **kwargs):
+        """Runs a blocking OpenAI helper call in a worker thread while the terminal shows progress."""
+        indicator = _ProgressIndicator(self._styles.thinking_label)
+        return self._run_with_progress(indicator, func, args, kwargs, on_cancel=self._cancel_openai_turn)
+
+    def _cancel_openai_turn(self):
+        cancel = getattr(self.openai_helper, "cancel_pending_turn", None)
+        if callable(cancel):
+            cancel()
+
+    @staticmethod
+    def _run_with_progress(indicator, func, args, kwargs, on_cancel=None):
+        """Runs func on a daemon thread; on Ctrl+C calls on_cancel and re-raises without waiting for it."""
+        outcome = {}
+
+        def worker():
+            try:
+                outcome["result"] = func(*args, **kwargs)
+            except BaseException as exc:  # pylint: disable=broad-except
+                outcome["error"] = exc
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            thread.join(_PROGRESS_DELAY_SECONDS)
+            while thread.is_alive():
+                indicator.tick()
+                thread.join(_PROGRESS_INTERVAL_SECONDS)
+        except KeyboardInterrupt:
+            # The worker cannot be stopped; make sure its late output and
+            # result are ignored once control is back at the prompt.
+            if on_cancel is not None:
+                on_cancel()
+            raise
+        finally:
+            indicator.clear()
+
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
+
+    def _analyze_outputs(self, outputs, execution_summary, allow_follow_up_commands=True):
+        """Sends an execution report to the assistant, prints its analysis and returns follow-up commands."""
+        self._sync_openai_session_context()
+        kwargs = {
+            "execution_summary": execution_summary,
+            "allow_follow_up_commands": allow_follow_up_commands,
+        }
+        indicator = _ProgressIndicator(self._styles.thinking_label)
+        echo = None
+        if self.stream_responses:
+            echo = _StreamEcho(indicator)
+            kwargs["on_text_delta"] = echo
+
+        def cancel():
+            if echo is not None:
+                echo.cancel()
+            self._cancel_openai_turn()
+
+        response, commands = self._run_with_progress(
+            indicator,
+            self.openai_helper.send_commands_outputs,
+            (outputs,),
+            kwargs,
+            on_cancel=cancel,
+        )
+        self._print_assistant_response(response, already_shown=echo is not None and echo.finish())
+        self._print_token_usage()
+        return commands
+
     def _print_commands_batch(self, commands):
-        print(colored("\nProposed commands:", "green"))
-        for index, command in enumerate(commands, start=1):
-            command_str = command.get("command", "").strip()
-            description = command.get("description", "").strip()
-            print(colored(f"[{index}] {command_str}", "blue"))
+        styles = self._styles
+        parts = [styles.commands_header, "\n"]
+        for index, spec in enumerate(commands, start=1):
+            description = spec.description
+            parts.extend((styles.command_prefix, "[", str(index), "] ", spec.command, styles.command_suffix, "\n"))
             if description:
-                print(colored(f"    {description}", "grey"))
+                parts.extend((styles.description_prefix, "    ", description, styles.description_suffix, "\n"))
+        sys.stdout.write("".join(parts))
+
+    @staticmethod
+    def _notice(text, color):
+        # One write per message and no explicit flush; pending output is
+        # flushed once before the next prompt blocks on user input.
+        sys.stdout.write(f"{colored(text, color)}\n")
 
     def _prompt_command_action(self, index, total):
+        styles = self._styles
         prompt_text = (
-            f"Command {index}/{total} action "
+            f"{styles.prompt_prefix}Command {index}/{total} action "
             f"[r=run, e=edit, s=skip, a=run all remaining, q=end batch, 1-{total}=run by number, Ctrl+C=exit loop] "
-            "(default s): "
+            f"(default s): {styles.prompt_suffix}"
         )
+        prompt_message = ANSI(prompt_text)
+        sys.stdout.flush()
         while True:
-            action = self.session.prompt(ANSI(colored(prompt_text, "green"))).strip().lower()
-            if action == "":
-                return "s"
-            if action in {"r", "e", "s", "a", "q", "y", "n"}:
-                return {"y": "r", "n": "s"}.get(action, action)
+            action = self.session.prompt(prompt_message).strip().lower()
+            resolved = _COMMAND_ACTION_ALIASES.get(action)
+            if resolved is not None:
+                return resolved
             if action.isdigit():
                 selected_index = int(action)
                 if 1 <= selected_index <= total:
@@ -146,131 +492,121 @@ class Application:
             print(colored(f"Invalid choice. Use r/e/s/a/q, number 1-{total}, or Ctrl+C.", "yellow"))
 
     def _prompt_yes_no(self, text):
+        styles = self._styles
+        prompt_text = f"{styles.prompt_prefix}{text}{styles.prompt_suffix}"
+        sys.stdout.flush()
         while True:
-            answer = self.session.prompt(ANSI(colored(text, "green"))).strip().lower()
+            answer = self.session.prompt(ANSI(prompt_text)).strip().lower()
             if answer in {"", "n", "no"}:
                 return False
             if answer in {"y", "yes"}:
                 return True
-            print(colored("Please answer with y or n.", "yellow"))
+            print(styles.yes_no_hint)
+
+    def _safe_mode_violation(self, candidate):
+        if self.safe_mode_strict:
+            strict_reason = self.command_helper.detect_non_readonly_command(candidate)
+            if strict_reason is not None:
+                return "strict", strict_reason
+
+        destructive_reason = self.command_helper.detect_destructive_command(candidate)
+        if destructive_reason is not None:
+            return "destructive", destructive_reason
+        return None
 
     def _guard_command_with_safe_mode(self, command_str):
         candidate = command_str
-        while True:
-            if not self.safe_mode_enabled:
+        while self.safe_mode_enabled:
+            # The detectors memoize per command, so edits that cycle back to
+            # an already checked command cost nothing extra.
+            violation = self._safe_mode_violation(candidate)
+            if violation is None:
                 return candidate, None
 
-            if self.safe_mode_strict:
-                strict_reason = self.command_helper.detect_non_readonly_command(candidate)
-                if strict_reason is not None:
-                    warning = f"Strict safe mode blocked command ({strict_reason}): {candidate}"
-                    print(colored(warning, "red"))
-                    self.interaction_logger.log_event(
-                        "strict_safe_mode_blocked_command",
-                        {"command": candidate, "reason": strict_reason},
-                    )
-                    prompt_text = "Strict safe mode action [e=edit, s=skip] (default s): "
-                    action = self.session.prompt(ANSI(colored(prompt_text, "yellow"))).strip().lower()
-
-                    if action in {"e", "edit"}:
-                        edited = self.session.prompt(
-                            ANSI(colored("Enter the modified command: ", "cyan")),
-                            default=candidate,
-                        ).strip()
-                        if edited == "":
-                            return None, "safe_mode_empty_after_edit"
-                        candidate = edited
-                        continue
-
-                    return None, "blocked_by_strict_safe_mode"
+            guard_state, reason = violation
+            policy = _SAFE_MODE_GUARD_POLICIES[guard_state]
+            print(colored(f"{policy['warning']} ({reason}): {candidate}", "red"))
+            self.interaction_logger.log_event(policy["event"], {"command": candidate, "reason": reason})
 
-            reason = self.command_helper.detect_destructive_command(candidate)
-            if reason is None:
-                return candidate, None
+            prompt_message = getattr(self._styles, policy["prompt"])
+            sys.stdout.flush()
+            answer = self.session.prompt(prompt_message).strip().lower()
+            action = policy["actions"].get(answer, "skip")
 
-            warning = f"Safe mode blocked high-risk command ({reason}): {candidate}"
-            print(colored(warning, "red"))
-            self.interaction_logger.log_event(
-                "safe_mode_blocked_command",
-                {"command": candidate, "reason": reason},
-            )
-            prompt_text = "Safe mode action [run=execute once, e=edit, s=skip] (default s): "
-            action = self.session.prompt(ANSI(colored(prompt_text, "yellow"))).strip().lower()
-
-            if action in {"run", "r"}:
+            if action == "run":
                 self.interaction_logger.log_event(
                     "safe_mode_override",
                     {"command": candidate, "reason": reason},
                 )
                 return candidate, None
 
-            if action in {"e", "edit"}:
-                edited = self.session.prompt(
-                    ANSI(colored("Enter the modified command: ", "cyan")),
-                    default=candidate,
-                ).strip()
+            if action == "edit":
+                edited = self.session.prompt(self._styles.edit_prompt, default=candidate).strip()
                 if edited == "":
                     return None, "safe_mode_empty_after_edit"
                 candidate = edited
                 continue
 
-            return None, "blocked_by_safe_mode"
+            return None, policy["skip_reason"]
 
-    def _handle_runtime_command(self, user_input):
-        normalized = user_input.strip().lower()
-        if normalized in {"safe", "/safe"}:
+        return candidate, None
+
+    def _show_setting_status(self, setting):
+        if setting == "safe":
             print(colored(
                 f"Safe mode is {self._safe_mode_status_text()} | strict read-only mode is {self._safe_mode_strict_status_text()}",
                 "green" if self.safe_mode_enabled else "yellow",
             ))
-            return True
-
-        if normalized in {"safe on", "/safe on"}:
-            self._set_safe_mode(True)
-            return True
-
-        if normalized in {"safe off", "/safe off"}:
-            if self._prompt_yes_no("Disable safe mode? This can execute destructive commands. (y/N): "):
-                self._set_safe_mode(False)
-            else:
-                print(colored("Safe mode stays ON.", "yellow"))
-            return True
-
-        if normalized in {"strict", "/strict"}:
+        elif setting == "strict":
             print(colored(
                 f"Strict safe mode (read-only allowlist) is {self._safe_mode_strict_status_text()}",
                 "green" if self.safe_mode_strict else "yellow",
             ))
-            return True
-
-        if normalized in {"strict on", "/strict on"}:
-            self._set_safe_mode_strict(True)
-            return True
-
-        if normalized in {"strict off", "/strict off"}:
-            self._set_safe_mode_strict(False)
-            return True
-
-        if normalized in {"tokens", "/tokens"}:
+        elif setting == "tokens":
             print(colored(
                 f"Token usage display: {self._show_tokens_status_text()}",
                 "green" if self.show_tokens else "yellow",
             ))
-            return True
-
-        if normalized in {"tokens on", "/tokens on"}:
-            self._set_show_tokens(True)
-            return True
+        elif setting == "batch":
+            print(colored(
+                f"Batch analysis (one report per command batch): {self._batch_analysis_status_text()}",
+                "green" if self.batch_analysis else "yellow",
+            ))
 
-        if normalized in {"tokens off", "/tokens off"}:
-            self._set_show_tokens(False)
-            return True
+    def _change_setting(self, setting, enabled):
+        if setting == "safe":
+            if enabled:
+                self._set_safe_mode(True)
+            elif self._prompt_yes_no("Disable safe mode? This can execute destructive commands. (y/N): "):
+                self._set_safe_mode(False)
+            else:
+                print(colored("Safe mode stays ON.", "yellow"))
+        elif setting == "strict":
+            self._set_safe_mode_strict(enabled)
+        elif setting == "tokens":
+            self._set_show_tokens(enabled)
+        elif setting == "batch":
+            self._set_batch_analysis(enabled)
+
+    def _handle_runtime_command(self, user_input, normalized=None):
+        if normalized is None:
+            normalized = user_input.strip().lower()
+        entry = _RUNTIME_COMMANDS.get(normalized)
+        if entry is None:
+            return False
 
-        return False
+        setting, enabled = entry
+        if enabled is None:
+            self._show_setting_status(setting)
+        else:
+            self._change_setting(setting, enabled)
+        return True
 
-    def interpret_and_execute_command(self, user_prompt):
+    def interpret_and_execute_command(self, user_prompt, normalized=None):
         """Interprets and executes the command."""
-        if user_prompt == "e":
+        if normalized is None:
+            normalized = user_prompt.strip().lower()
+        if normalized == "e":
             self.manual_command_mode()
         else:
             self.auto_command_mode(user_prompt)
@@ -299,20 +635,17 @@ class Application:
 
         command_output = self.command_helper.run_shell_command(guarded_command)
         self.interaction_logger.log_event("command_executed", command_output)
-        outputs = [command_output]
+        outputs = [self._limit_report_output(command_output)]
         execution_summary = [{"command": guarded_command, "status": "executed"}]
 
-        self._sync_openai_session_context()
-        response, commands = self.openai_helper.send_commands_outputs(outputs, execution_summary=execution_summary)
-        self._print_assistant_response(response)
-        self._print_token_usage()
+        commands = self._analyze_outputs(outputs, execution_summary)
         if commands:
             self.execute_commands(commands)
 
     def auto_command_mode(self, user_prompt):
         """Auto command mode."""
         self._sync_openai_session_context()
-        commands_payload = self.openai_helper.get_commands(user_prompt)
+        commands_payload = self._call_openai(self.openai_helper.get_commands, user_prompt)
         self._print_token_usage()
         self.interaction_logger.log_event("auto_mode_commands_payload", commands_payload)
         if commands_payload and commands_payload.get("response"):
@@ -328,10 +661,18 @@ class Application:
 
     def execute_commands(self, commands):
         """Executes the commands."""
+        # Bound once: these are looked up for every command in every batch.
+        prompt_action = self._prompt_command_action
+        guard_command = self._guard_command_with_safe_mode
+        run_shell = self.command_helper.run_shell_command
+        log_event = self.interaction_logger.log_event
+        session_prompt = self.session.prompt
+        notice = self._notice
         while commands:
             try:
+                log_event("commands_batch", commands)
+                commands = [CommandSpec.from_payload(command) for command in commands]
                 self._print_commands_batch(commands)
-                self.interaction_logger.log_event("commands_batch", commands)
 
                 executed_any = False
                 execution_summary = []
@@ -339,8 +680,8 @@ class Application:
                 run_all_remaining = False
                 selected_command_index = None
 
-                for index, command in enumerate(commands, start=1):
-                    command_str = command.get("command", "").strip()
+                for index, spec in enumerate(commands, start=1):
+                    command_str = spec.command
                     if command_str == "":
                         execution_summary.append({"command": "", "status": "skipped_empty"})
                         continue
@@ -353,24 +694,24 @@ class Application:
                         action = "r"
                         selected_command_index = None
                     else:
-                        action = self._prompt_command_action(index, len(commands))
+                        action = prompt_action(index, len(commands))
 
                     while action.isdigit():
                         selected_index = int(action)
                         if selected_index < index:
-                            print(colored(f"Command {selected_index} was already processed; choose current or later.", "yellow"))
-                            action = self._prompt_command_action(index, len(commands))
+                            notice(f"Command {selected_index} was already processed; choose current or later.", "yellow")
+                            action = prompt_action(index, len(commands))
                             continue
                         if selected_index > index:
                             selected_command_index = selected_index
-                            print(colored(f"Selecting command {selected_index}; skipping command {index}.", "yellow"))
+                            notice(f"Selecting command {selected_index}; skipping command {index}.", "yellow")
                             action = "s"
                         else:
                             action = "r"
                         break
 
                     if action == "q":
-                        print(colored("Ending current command batch.", "yellow"))
+                        notice("Ending current command batch.", "yellow")
                         execution_summary.append({"command": command_str, "status": "stopped_by_user"})
                         break
 
@@ -379,23 +720,23 @@ class Application:
                         action = "r"
 
                     if action == "e":
-                        edited_command = self.session.prompt(
-                            ANSI(colored("Enter the modified command: ", "cyan")),
+                        edited_command = session_prompt(
+                            self._styles.edit_prompt,
                             default=command_str,
                         ).strip()
                         if edited_command == "":
-                            print(colored("Empty command after edit, skipping.", "yellow"))
+                            notice("Empty command after edit, skipping.", "yellow")
                             execution_summary.append({"command": command_str, "status": "skipped_empty_after_edit"})
-                            self.interaction_logger.log_event(
+                            log_event(
                                 "command_skipped",
                                 {"command": command_str, "reason": "empty_after_edit"},
                             )
                             continue
                         command_str = edited_command
                         if not self._prompt_yes_no("Run the edited command? (y/N): "):
-                            print(colored("Skipping command", "yellow"))
+                            notice("Skipping command", "yellow")
                             execution_summary.append({"command": command_str, "status": "skipped_after_edit"})
-                            self.interaction_logger.log_event(
+                            log_event(
                                 "command_skipped",
                                 {"command": command_str, "reason": "skipped_after_edit"},
                             )
@@ -403,22 +744,22 @@ class Application:
                         action = "r"
 
                     if action == "s":
-                        print(colored("Skipping command", "yellow"))
+                        notice("Skipping command", "yellow")
                         execution_summary.append({"command": command_str, "status": "skipped"})
-                        self.interaction_logger.log_event("command_skipped", {"command": command_str})
+                        log_event("command_skipped", {"command": command_str})
                         continue
 
-                    guarded_command, skip_reason = self._guard_command_with_safe_mode(command_str)
+                    guarded_command, skip_reason = guard_command(command_str)
                     if guarded_command is None:
-                        print(colored("Skipping command (safe mode).", "yellow"))
+                        notice("Skipping command (safe mode).", "yellow")
                         execution_summary.append({"command": command_str, "status": "blocked_by_safe_mode"})
-                        self.interaction_logger.log_event(
+                        log_event(
                             "command_skipped",
                             {"command": command_str, "reason": skip_reason},
                         )
                         continue
 
-                    output = self.command_helper.run_shell_command(guarded_command)
+                    output = run_shell(guarded_command)
                     execution_record = {
                         "command": guarded_command,
                         "status": "executed",
@@ -427,50 +768,48 @@ class Application:
                         "interrupted": output.get("interrupted"),
                     }
                     execution_summary.append(execution_record)
+                    log_event("command_executed", output)
+                    output = self._limit_report_output(output)
                     outputs.append(output)
-                    self.interaction_logger.log_event("command_executed", output)
                     executed_any = True
 
-                    # In run-all mode (action "a"), execute remaining commands first
-                    # and send one combined report to the assistant at the end.
-                    if run_all_remaining:
+                    # In run-all mode (action "a") or with batch analysis on, execute
+                    # remaining commands first and send one combined report at the end.
+                    if run_all_remaining or self.batch_analysis:
                         continue
 
-                    self._sync_openai_session_context()
-                    response, _ = self.openai_helper.send_commands_outputs(
-                        [output],
-                        execution_summary=[execution_record],
-                        allow_follow_up_commands=False,
-                    )
-                    self._print_assistant_response(response)
-                    self._print_token_usage()
+                    self._analyze_outputs([output], [execution_record], allow_follow_up_commands=False)
 
                 self.interaction_logger.log_event("commands_execution_summary", execution_summary)
                 if not executed_any:
-                    print(colored("No commands were executed.", "yellow"))
+                    notice("No commands were executed.", "yellow")
                     break
 
-                self._sync_openai_session_context()
-                response, next_commands = self.openai_helper.send_commands_outputs(
-                    outputs,
-                    execution_summary=execution_summary,
-                    allow_follow_up_commands=True,
-                )
-                self._print_assistant_response(response)
-                self._print_token_usage()
-                commands = next_commands
+                commands = self._analyze_outputs(outputs, execution_summary, allow_follow_up_commands=True)
             except KeyboardInterrupt:
-                print(colored("Command loop interrupted (Ctrl+C). Returning to main prompt.", "yellow"))
+                notice("Command loop interrupted (Ctrl+C). Returning to main prompt.", "yellow")
                 self.interaction_logger.log_event("commands_loop_interrupted", {"reason": "keyboard_interrupt"})
                 return
 
+    def _print_command_failure(self, exc):
+        styles = self._styles
+        message = f"Error: Command failed with exit code {exc.returncode}: {exc.output}"
+        print("".join((styles.error_prefix, message, styles.error_suffix)), file=sys.stderr)
+
+    def _print_fatal_error(self, exc):
+        styles = self._styles
+        message = f"Error of type {type(exc).__name__}: {exc}"
+        print("".join((styles.error_prefix, message, styles.error_suffix)))
+        print(styles.exiting)
+
     def _process_user_input(self, user_input):
-        if user_input.lower() == "q":
+        normalized = user_input.strip().lower()
+        if normalized == "q":
             return False
         self.interaction_logger.log("user", user_input)
-        if self._handle_runtime_command(user_input):
+        if self._handle_runtime_command(user_input, normalized):
             return True
-        self.interpret_and_execute_command(user_input)
+        self.interpret_and_execute_command(user_input, normalized)
         return True
 
     def run(self, initial_prompt=None, exit_after_initial_prompt=False):
@@ -489,69 +828,122 @@ class Application:
             print(colored("Type 'e' for manual mode, or 'q' to quit.\n", "green"))
 
         if has_initial_prompt:
-            prompt_preview = initial_prompt
-            piped_marker = "\n\nPiped input:\n"
-            if piped_marker in prompt_preview:
-                prompt_preview = f"{prompt_preview.split(piped_marker, 1)[0]}\n\n[stdin attached]"
-            print(colored("Initial prompt:", "cyan"))
-            print(colored(prompt_preview, "white"))
-            print()
-            try:
-                if not self._process_user_input(initial_prompt):
-                    return
-            except subprocess.CalledProcessError as exc:
-                print(
-                    colored(f"Error: Command failed with exit code {exc.returncode}: {exc.output}", "red"),
-                    file=sys.stderr,
-                )
-            except KeyboardInterrupt:
-                if exit_after_initial_prompt:
-                    return
-            except EOFError:
-                return
-            except Exception as exc:  # pylint: disable=broad-except
-                print(colored(f"Error of type {type(exc).__name__}: {exc}", "red"))
-                print(colored("Exiting...", "yellow"))
+            if not self._run_once(initial_prompt, exit_after_initial_prompt):
                 return
 
+        self._run_forever()
+
+    def _run_once(self, initial_prompt, exit_after_initial_prompt):
+        """Handles the prompt passed on the command line; returns whether to enter the REPL."""
+        prompt_preview = initial_prompt
+        piped_marker = "\n\nPiped input:\n"
+        if piped_marker in prompt_preview:
+            prompt_preview = f"{prompt_preview.split(piped_marker, 1)[0]}\n\n[stdin attached]"
+        print(colored("Initial prompt:", "cyan"))
+        print(colored(prompt_preview, "white"))
+        print()
+        try:
+            if not self._process_user_input(initial_prompt):
+                return False
+        except subprocess.CalledProcessError as exc:
+            self._print_command_failure(exc)
+        except KeyboardInterrupt:
             if exit_after_initial_prompt:
-                return
+                return False
+        except EOFError:
+            return False
+        except Exception as exc:  # pylint: disable=broad-except
+            self._print_fatal_error(exc)
+            return False
 
+        return not exit_after_initial_prompt
+
+    def _run_forever(self):
+        """Runs the interactive REPL until the user quits."""
+        repl_prompt = ANSI(colored(f"{APP_NAME}: ", "green"))
         while True:
             try:
-                user_input = self.session.prompt(ANSI(colored(f"{APP_NAME}: ", "green")))
+                user_input = self.session.prompt(repl_prompt)
                 if not self._process_user_input(user_input):
                     break
             except subprocess.CalledProcessError as exc:
-                print(
-                    colored(f"Error: Command failed with exit code {exc.returncode}: {exc.output}", "red"),
-                    file=sys.stderr,
-                )
+                self._print_command_failure(exc)
             except KeyboardInterrupt:
                 continue
             except EOFError:
                 break
             except Exception as exc:  # pylint: disable=broad-except
-                print(colored(f"Error of type {type(exc).__name__}: {exc}", "red"))
-                print(colored("Exiting...", "yellow"))
+                self._print_fatal_error(exc)
                 break
 
 
 class FileHistoryPath:
     @staticmethod
     def default():
-        from os.path import expanduser
-
         return expanduser("~/.prompt2shell_history")
 
     @staticmethod
     def legacy():
-        from os.path import expanduser
-
         return expanduser("~/.gpts_history")
 
     @staticmethod
     def exists(path):
-        from os.path import exists
+        return _path_exists(path)
+
+
+class BackgroundFileHistory(FileHistory):
+    """FileHistory that appends new entries from a daemon thread.
+
+    Accepted prompts are queued and written in batches, so a slow history file
+    (network mounts, fsync-heavy filesystems) never stalls the REPL between
+    turns. Pending entries are flushed at interpreter exit.
+    """
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self._pending = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def store_string(self, string):
+        self._pending.put(string)
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_pending_forever,
+                    name="prompt2shell-history",
+                    daemon=True,
+                )
+                self._writer.start()
 
-        return exists(path)
+    def flush(self):
+        self._pending.join()
+
+    def _write_pending_forever(self):
+        while True:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except OSError:
+                pass
+            except Exception as exc:  # pylint: disable=broad-except
+                # Keep the writer alive: flush() at exit waits on it.
+                print(colored(f"Warning: unable to write history: {exc}", "yellow"), file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    def _write_batch(self, strings):
+        # Same on-disk format as FileHistory.store_string.
+        chunks = []
+        for string in strings:
+            chunks.append(f"\n# {datetime.now()}\n")
+            chunks.extend(f"+{line}\n" for line in string.split("\n"))
+        with open(self.filename, "ab") as history_file:
+            history_file.write("".join(chunks).encode("utf-8"))
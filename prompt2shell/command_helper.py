@@ -1,12 +1,218 @@
+import codecs
+import functools
 import os
 import re
+import selectors
 import shlex
+import shutil
 import signal
 import subprocess
+import sys
 import threading
 
 from .common import colored
 
+# Secret patterns applied one after another, each to the output of the
+# previous one; later patterns rely on earlier replacements (e.g. a Bearer
+# token followed by NAME=value), so they must not be fused into one scan.
+_REDACTION_RULES = (
+    (r"(?i)\b(Authorization)\b(\s*[:=]\s*)Bearer\s+[A-Za-z0-9\-._~+/]+=*", r"\1\2Bearer <REDACTED>"),
+    (
+        r"(?i)\b([A-Z0-9_]*(?:API[_-]?KEY|TOKEN|SECRET|PASSWORD|PASSWD)[A-Z0-9_]*)\b(\s*[:=]\s*)"
+        r"([^\s\"']+|\"[^\"]*\"|'[^']*')",
+        r"\1\2<REDACTED>",
+    ),
+    (r"(?i)\b(Bearer)\s+[A-Za-z0-9\-._~+/]+=*", r"\1 <REDACTED>"),
+    (r"\bsk-[A-Za-z0-9]{12,}\b", "<REDACTED_OPENAI_KEY>"),
+    (r"\beyJ[A-Za-z0-9_-]{10,}\.[A-Za-z0-9._-]+\.[A-Za-z0-9._-]+\b", "<REDACTED_JWT>"),
+    (r"\bAKIA[0-9A-Z]{16}\b", "<REDACTED_AWS_ACCESS_KEY_ID>"),
+)
+_REDACTION_PASSES = tuple((re.compile(pattern), template) for pattern, template in _REDACTION_RULES)
+# Bytes twins used on raw command output, so it is redacted before decoding.
+# In bytes mode \b only knows ASCII word characters; counting UTF-8 bytes as
+# word characters keeps boundaries next to non-ASCII letters as in str mode.
+_BYTES_WORD_BOUNDARY = r"(?:(?<![\w\x80-\xff])(?=[\w\x80-\xff])|(?<=[\w\x80-\xff])(?![\w\x80-\xff]))"
+_REDACTION_BYTES_PASSES = tuple(
+    (re.compile(pattern.replace(r"\b", _BYTES_WORD_BOUNDARY).encode("ascii")), template.encode("ascii"))
+    for pattern, template in _REDACTION_RULES
+)
+# Cheap superset of the patterns above: text without any of these markers
+# cannot contain anything to redact.
+_REDACTION_HINT_PATTERN = r"sk-|eyJ|AKIA|bearer|authorization|token|secret|passw(?:or)?d|api[_-]?key"
+_REDACTION_HINT_RE = re.compile(_REDACTION_HINT_PATTERN, re.IGNORECASE)
+_REDACTION_HINT_BYTES_RE = re.compile(_REDACTION_HINT_PATTERN.encode("ascii"), re.IGNORECASE)
+
+
+_READ_CHUNK_SIZE = 64 * 1024
+
+# Output without line breaks (binary data, \r progress bars) is echoed once
+# this much of it is waiting, instead of buffering until the next newline.
+_ECHO_PENDING_MAX_BYTES = 64 * 1024
+
+# Bytes of each command stream kept for the result; output beyond this is
+# only echoed (reports to the model are capped far lower anyway).
+_CAPTURE_HEAD_BYTES = 1024 * 1024
+_CAPTURE_TAIL_BYTES = 1024 * 1024
+
+# Longer texts are redacted without caching, so the cache stays small.
+_REDACTION_CACHE_MAX_CHARS = 64 * 1024
+
+_IS_POSIX = os.name == "posix"
+_IS_WINDOWS = os.name == "nt"
+
+# Popen options shared by every command; each command runs in its own process
+# group so a timeout can take down everything it started.
+_BASE_POPEN_KWARGS = {
+    "shell": True,
+    "stdout": subprocess.PIPE,
+    "stderr": subprocess.PIPE,
+    "bufsize": 0,
+}
+if _IS_POSIX:
+    _BASE_POPEN_KWARGS["start_new_session"] = True
+elif _IS_WINDOWS:
+    _BASE_POPEN_KWARGS["creationflags"] = getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
+
+_TERMINATE_GRACE_SECONDS = 2
+
+# Popen.wait(timeout=...) polls the child with a sleep loop; a pidfd becomes
+# readable when the child exits, so one select() covers the whole wait.
+_HAS_PIDFD = hasattr(os, "pidfd_open")
+_POPEN_TYPE = subprocess.Popen
+# Resolved once; only needed to kill process trees on Windows.
+_TASKKILL_PATH = shutil.which("taskkill") if _IS_WINDOWS else None
+
+# `match` anchors at the start; only the NAME= prefix needs checking.
+_ENV_ASSIGNMENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*=")
+
+# Characters that give shlex.split work to do (quoting and escapes).
+_SHLEX_SPECIAL_CHARS = frozenset("'\"\\")
+# shlex only splits on these; str.split() would also break on e.g. NBSP or \v.
+_SHLEX_WHITESPACE_RE = re.compile(r"[ \t\r\n]+")
+
+
+def _decode_output(data):
+    # Command output is read as bytes; decode it the way text-mode pipes did,
+    # including universal newline translation.
+    text = bytes(data).decode("utf-8", errors="replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+# Secrets never span a line break, and tokens never span a space or tab.
+_CUT_BOUNDARIES = (b" ", b"\t", b"\r")
+
+
+def _head_cut(data):
+    """Offset just past the last line (or word) boundary in data; 0 if there is none."""
+    end = data.rfind(b"\n") + 1
+    if end:
+        return end
+    return max(data.rfind(boundary) for boundary in _CUT_BOUNDARIES) + 1
+
+
+def _tail_cut(data):
+    """Offset just past the first line (or word) boundary in data; len(data) if there is none."""
+    start = data.find(b"\n") + 1
+    if start:
+        return start
+    positions = [position for position in (data.find(boundary) for boundary in _CUT_BOUNDARIES) if position >= 0]
+    return min(positions) + 1 if positions else len(data)
+
+
+class _StreamCapture:
+    """Echoes one command pipe line by line and keeps a bounded copy of its output.
+
+    The first CAPTURE_HEAD_BYTES and the last CAPTURE_TAIL_BYTES are kept;
+    anything in between was already shown on the terminal and is replaced
+    by a truncation marker, so a runaway command cannot exhaust memory.
+    """
+
+    __slots__ = ("stream", "fd", "color", "head", "tail", "dropped", "pending", "decoder", "closed")
+
+    def __init__(self, stream, color=None):
+        self.stream = stream
+        self.fd = stream.fileno()
+        self.color = color
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.dropped = 0
+        self.pending = bytearray()
+        # Partial lines may end inside a multi-byte character; the decoder
+        # carries it over to the next echo.
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.closed = False
+
+    def feed(self, chunk):
+        self._store(chunk)
+        start = len(self.pending)
+        self.pending += chunk
+        # Only the new chunk can hold a newline; earlier bytes were searched.
+        newline = chunk.rfind(b"\n")
+        if newline >= 0:
+            self._echo(start + newline + 1)
+        elif len(self.pending) >= _ECHO_PENDING_MAX_BYTES:
+            # Keep a trailing \r back in case the next chunk starts with \n.
+            self._echo(len(self.pending) - self.pending.endswith(b"\r"))
+
+    def _store(self, chunk):
+        room = _CAPTURE_HEAD_BYTES - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        if not chunk:
+            return
+        self.tail += chunk
+        # Trim only once the tail doubles, so the cost is amortized per byte.
+        if len(self.tail) > 2 * _CAPTURE_TAIL_BYTES:
+            self._trim_tail()
+
+    def _trim_tail(self):
+        excess = len(self.tail) - _CAPTURE_TAIL_BYTES
+        if excess > 0:
+            del self.tail[:excess]
+            self.dropped += excess
+
+    def finish(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._echo(len(self.pending), final=True)
+        self._trim_tail()
+        self.stream.close()
+
+    def redacted_text(self):
+        if not self.dropped:
+            return _decode_output(CommandHelper.redact_sensitive_bytes(self.head + self.tail))
+        # The windows were cut at arbitrary bytes; a secret straddling a cut
+        # would lose the prefix redaction keys on, so partial lines go too.
+        head_end = _head_cut(self.head)
+        tail_start = _tail_cut(self.tail)
+        dropped = self.dropped + len(self.head) - head_end + tail_start
+        head = _decode_output(CommandHelper.redact_sensitive_bytes(self.head[:head_end]))
+        tail = _decode_output(CommandHelper.redact_sensitive_bytes(self.tail[tail_start:]))
+        return f"{head}\n...[truncated {dropped} bytes]...\n{tail}"
+
+    def _echo(self, end, final=False):
+        text = self.decoder.decode(bytes(self.pending[:end]), final)
+        del self.pending[:end]
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if not text:
+            return
+        if self.color:
+            lines = text.split("\n")
+            partial = lines.pop()
+            text = "".join(f"{colored(line, self.color) if line else ''}\n" for line in lines)
+            if partial:
+                # The rest of this line arrives in a later echo; only the
+                # final one closes it with a newline.
+                text += f"{colored(partial, self.color)}\n" if final else colored(partial, self.color)
+        # One write per chunk of complete lines; a TTY stdout is line-buffered
+        # and flushes on the newline, a redirected one batches further.
+        sys.stdout.write(text)
+
 
 class CommandHelper:
     """Helper class for executing commands."""
@@ -33,75 +239,117 @@ class CommandHelper:
         (re.compile(r":\(\)\s*\{\s*:\|:&\s*\};:", re.IGNORECASE), "fork bomb pattern"),
     )
 
-    STRICT_SAFE_MODE_READ_ONLY_COMMANDS = {
-        "basename",
-        "cat",
-        "cut",
-        "date",
-        "df",
-        "diff",
-        "dirname",
-        "du",
-        "echo",
-        "env",
-        "file",
-        "find",
-        "git",
-        "grep",
-        "head",
-        "hostname",
-        "id",
-        "jq",
-        "less",
-        "ls",
-        "md5sum",
-        "nl",
-        "printf",
-        "ps",
-        "pwd",
-        "readlink",
-        "realpath",
-        "rg",
-        "sed",
-        "sha1sum",
-        "sha256sum",
-        "sort",
-        "stat",
-        "tail",
-        "tee",
-        "tr",
-        "uname",
-        "uniq",
-        "wc",
-        "whoami",
-    }
-
-    STRICT_SAFE_MODE_READ_ONLY_GIT_SUBCOMMANDS = {
-        "branch",
-        "diff",
-        "log",
-        "remote",
-        "rev-parse",
-        "show",
-        "status",
-        "tag",
-    }
-
-    STRICT_SAFE_MODE_FORBIDDEN_FIND_FLAGS = {
-        "-delete",
-        "-exec",
-        "-execdir",
-        "-ok",
-        "-okdir",
-        "-fprint",
-        "-fprint0",
-        "-fprintf",
-        "-fls",
-    }
+    # All destructive patterns as one alternation, so a command is scanned once;
+    # `lastgroup` names the pattern that matched.
+    _DESTRUCTIVE_COMMAND_RE = re.compile(
+        "|".join(f"(?P<p{index}>{pattern.pattern})" for index, (pattern, _) in enumerate(DESTRUCTIVE_COMMAND_PATTERNS)),
+        re.IGNORECASE,
+    )
+    _DESTRUCTIVE_COMMAND_REASONS = {f"p{index}": reason for index, (_, reason) in enumerate(DESTRUCTIVE_COMMAND_PATTERNS)}
+
+    STRICT_SAFE_MODE_READ_ONLY_COMMANDS = frozenset(
+        {
+            "basename",
+            "cat",
+            "cut",
+            "date",
+            "df",
+            "diff",
+            "dirname",
+            "du",
+            "echo",
+            "env",
+            "file",
+            "find",
+            "git",
+            "grep",
+            "head",
+            "hostname",
+            "id",
+            "jq",
+            "less",
+            "ls",
+            "md5sum",
+            "nl",
+            "printf",
+            "ps",
+            "pwd",
+            "readlink",
+            "realpath",
+            "rg",
+            "sed",
+            "sha1sum",
+            "sha256sum",
+            "sort",
+            "stat",
+            "tail",
+            "tee",
+            "tr",
+            "uname",
+            "uniq",
+            "wc",
+            "whoami",
+        }
+    )
+
+    STRICT_SAFE_MODE_READ_ONLY_GIT_SUBCOMMANDS = frozenset(
+        {
+            "branch",
+            "diff",
+            "log",
+            "remote",
+            "rev-parse",
+            "show",
+            "status",
+            "tag",
+        }
+    )
+
+    STRICT_SAFE_MODE_FORBIDDEN_FIND_FLAGS = frozenset(
+        {
+            "-delete",
+            "-exec",
+            "-execdir",
+            "-ok",
+            "-okdir",
+            "-fprint",
+            "-fprint0",
+            "-fprintf",
+            "-fls",
+        }
+    )
+
+    # Shell operators rejected in strict safe mode, in reporting priority order.
+    STRICT_SAFE_MODE_FORBIDDEN_OPERATORS = (
+        ("multiline", ("\n",), "multiline commands are blocked in strict safe mode"),
+        ("chaining", ("&&", "||", ";"), "command chaining operators are blocked in strict safe mode"),
+        ("substitution", ("`", "$("), "command substitution is blocked in strict safe mode"),
+        ("stderr_pipe", ("|&",), "stderr pipe redirection is blocked in strict safe mode"),
+        ("output_redirect", (">",), "output redirection is blocked in strict safe mode"),
+        ("advanced_redirect", ("<&", "<>", "<<"), "advanced redirection is blocked in strict safe mode"),
+    )
+
+    # One scan finds every operator occurrence: the lookahead lets matches
+    # overlap (`>` inside `<>`), and alternatives sharing a start position
+    # are tried in priority order.
+    _STRICT_OPERATOR_RE = re.compile(
+        "(?="
+        + "|".join(
+            f"(?P<{name}>{'|'.join(re.escape(literal) for literal in literals)})"
+            for name, literals, _ in STRICT_SAFE_MODE_FORBIDDEN_OPERATORS
+        )
+        + ")"
+    )
+    _STRICT_OPERATOR_PRIORITY = {name: priority for priority, (name, _, _) in enumerate(STRICT_SAFE_MODE_FORBIDDEN_OPERATORS)}
 
     @staticmethod
     def _command_timeout_seconds():
-        raw_timeout = os.getenv("PROMPT2SHELL_COMMAND_TIMEOUT", "300")
+        return CommandHelper._parse_command_timeout(os.getenv("PROMPT2SHELL_COMMAND_TIMEOUT", "300"))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _parse_command_timeout(raw_timeout):
+        # Keyed by the raw value, so a changed environment is still honored.
         try:
             timeout = int(raw_timeout)
         except (TypeError, ValueError):
@@ -112,22 +360,31 @@ class CommandHelper:
     def detect_destructive_command(command):
         if not isinstance(command, str) or command.strip() == "":
             return None
-        normalized = command.strip()
-        for pattern, reason in CommandHelper.DESTRUCTIVE_COMMAND_PATTERNS:
-            if pattern.search(normalized):
-                return reason
-        return None
+        return CommandHelper._detect_destructive_cached(command)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _detect_destructive_cached(command):
+        # Commands repeat across a session; results depend only on the text.
+        match = CommandHelper._DESTRUCTIVE_COMMAND_RE.search(command.strip())
+        if match is None:
+            return None
+        return CommandHelper._DESTRUCTIVE_COMMAND_REASONS[match.lastgroup]
 
     @staticmethod
     def _is_env_assignment(token):
-        return bool(re.match(r"^[A-Za-z_][A-Za-z0-9_]*=.*$", token))
+        return _ENV_ASSIGNMENT_RE.match(token) is not None
 
     @staticmethod
     def _extract_executable(segment):
-        try:
-            tokens = shlex.split(segment, posix=True)
-        except ValueError:
-            return None, None, "unable to parse command segment"
+        if _SHLEX_SPECIAL_CHARS.isdisjoint(segment):
+            # Nothing for shlex to interpret: splitting on its whitespace is identical.
+            tokens = [token for token in _SHLEX_WHITESPACE_RE.split(segment) if token]
+        else:
+            try:
+                tokens = shlex.split(segment, posix=True)
+            except ValueError:
+                return None, None, "unable to parse command segment"
 
         if not tokens:
             return None, None, "empty command segment"
@@ -143,25 +400,33 @@ class CommandHelper:
         args = tokens[index + 1:]
         return executable, args, None
 
+    @staticmethod
+    def _find_forbidden_operator(command):
+        best = None
+        for match in CommandHelper._STRICT_OPERATOR_RE.finditer(command):
+            priority = CommandHelper._STRICT_OPERATOR_PRIORITY[match.lastgroup]
+            if best is None or priority < best:
+                best = priority
+                if priority == 0:
+                    break
+        if best is None:
+            return None
+        return CommandHelper.STRICT_SAFE_MODE_FORBIDDEN_OPERATORS[best][2]
+
     @staticmethod
     def detect_non_readonly_command(command):
         if not isinstance(command, str) or command.strip() == "":
             return "empty command"
+        return CommandHelper._detect_non_readonly_cached(command)
 
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _detect_non_readonly_cached(command):
         normalized = command.strip()
 
-        if "\n" in normalized:
-            return "multiline commands are blocked in strict safe mode"
-        if "&&" in normalized or "||" in normalized or ";" in normalized:
-            return "command chaining operators are blocked in strict safe mode"
-        if "`" in normalized or "$(" in normalized:
-            return "command substitution is blocked in strict safe mode"
-        if "|&" in normalized:
-            return "stderr pipe redirection is blocked in strict safe mode"
-        if ">" in normalized:
-            return "output redirection is blocked in strict safe mode"
-        if "<&" in normalized or "<>" in normalized or "<<" in normalized:
-            return "advanced redirection is blocked in strict safe mode"
+        operator_reason = CommandHelper._find_forbidden_operator(normalized)
+        if operator_reason is not None:
+            return operator_reason
 
         for segment in (part.strip() for part in normalized.split("|")):
             executable, args, parse_error = CommandHelper._extract_executable(segment)
@@ -173,18 +438,16 @@ class CommandHelper:
                 return f"command `{executable}` is not in strict read-only allowlist"
 
             if lowered_exec == "find":
-                lowered_args = {arg.lower() for arg in args}
-                forbidden = lowered_args.intersection(CommandHelper.STRICT_SAFE_MODE_FORBIDDEN_FIND_FLAGS)
-                if forbidden:
-                    return f"find flag `{sorted(forbidden)[0]}` is blocked in strict safe mode"
+                for arg in args:
+                    lowered_arg = arg.lower()
+                    if lowered_arg in CommandHelper.STRICT_SAFE_MODE_FORBIDDEN_FIND_FLAGS:
+                        return f"find flag `{lowered_arg}` is blocked in strict safe mode"
 
             if lowered_exec == "sed":
-                lowered_args = [arg.lower() for arg in args]
-                if any(
-                    arg == "-i" or arg.startswith("-i") or arg == "--in-place" or arg.startswith("--in-place=")
-                    for arg in lowered_args
-                ):
-                    return "sed in-place editing is blocked in strict safe mode"
+                for arg in args:
+                    lowered_arg = arg.lower()
+                    if lowered_arg.startswith("-i") or lowered_arg == "--in-place" or lowered_arg.startswith("--in-place="):
+                        return "sed in-place editing is blocked in strict safe mode"
 
             if lowered_exec == "tee" and args:
                 return "tee file output is blocked in strict safe mode"
@@ -198,65 +461,138 @@ class CommandHelper:
 
         return None
 
+    @staticmethod
+    def truncate_text(text, max_chars):
+        if not isinstance(text, str) or max_chars is None or len(text) <= max_chars:
+            return text
+        # Keep both ends: headers and first lines are at the start, while
+        # errors and summaries usually come last.
+        omitted = len(text) - max_chars
+        head_chars = (max_chars + 1) // 2
+        tail = text[len(text) - (max_chars - head_chars):] if max_chars > head_chars else ""
+        return f"{text[:head_chars]}\n...[truncated {omitted} chars]...\n{tail}"
+
     @staticmethod
     def redact_sensitive_text(text):
         if not isinstance(text, str) or text == "":
             return text
 
-        redacted = text
-        redacted = re.sub(
-            r"(?i)\b(Authorization)\b(\s*[:=]\s*)Bearer\s+[A-Za-z0-9\-._~+/]+=*",
-            r"\1\2Bearer <REDACTED>",
-            redacted,
-        )
-        redacted = re.sub(
-            r"(?i)\b([A-Z0-9_]*(?:API[_-]?KEY|TOKEN|SECRET|PASSWORD|PASSWD)[A-Z0-9_]*)\b(\s*[:=]\s*)([^\s\"']+|\"[^\"]*\"|'[^']*')",
-            r"\1\2<REDACTED>",
-            redacted,
-        )
-        redacted = re.sub(
-            r"(?i)\b(Bearer)\s+[A-Za-z0-9\-._~+/]+=*",
-            r"\1 <REDACTED>",
-            redacted,
-        )
-        redacted = re.sub(r"\bsk-[A-Za-z0-9]{12,}\b", "<REDACTED_OPENAI_KEY>", redacted)
-        redacted = re.sub(
-            r"\beyJ[A-Za-z0-9_-]{10,}\.[A-Za-z0-9._-]+\.[A-Za-z0-9._-]+\b",
-            "<REDACTED_JWT>",
-            redacted,
-        )
-        redacted = re.sub(r"\bAKIA[0-9A-Z]{16}\b", "<REDACTED_AWS_ACCESS_KEY_ID>", redacted)
-        return redacted
+        if _REDACTION_HINT_RE.search(text) is None:
+            return text
+        for pattern, template in _REDACTION_PASSES:
+            text = pattern.sub(template, text)
+        return text
+
+    @staticmethod
+    def redact_sensitive_text_cached(text):
+        """Same result as redact_sensitive_text, memoized for texts that get logged repeatedly."""
+        if not isinstance(text, str) or len(text) > _REDACTION_CACHE_MAX_CHARS:
+            return CommandHelper.redact_sensitive_text(text)
+        return CommandHelper._redact_cached(text)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _redact_cached(text):
+        return CommandHelper.redact_sensitive_text(text)
+
+    @staticmethod
+    def may_need_redaction(text):
+        """Cheap check for secret markers; accepts str or UTF-8 bytes."""
+        hint_re = _REDACTION_HINT_BYTES_RE if isinstance(text, (bytes, bytearray)) else _REDACTION_HINT_RE
+        return hint_re.search(text) is not None
+
+    @staticmethod
+    def redact_sensitive_bytes(data):
+        if not data:
+            return data
+        if _REDACTION_HINT_BYTES_RE.search(data) is None:
+            return data
+        for pattern, template in _REDACTION_BYTES_PASSES:
+            data = pattern.sub(template, data)
+        return data
 
     @staticmethod
-    def _read_stream(stream, sink, color=None):
+    def _read_streams(captures):
+        """Drains the given pipes until EOF, echoing complete lines as they arrive."""
+        if len(captures) == 1:
+            capture = captures[0]
+            try:
+                while True:
+                    chunk = os.read(capture.fd, _READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    capture.feed(chunk)
+            finally:
+                capture.finish()
+            return
+
+        with selectors.DefaultSelector() as selector:
+            for capture in captures:
+                selector.register(capture.fd, selectors.EVENT_READ, capture)
+            try:
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        capture = key.data
+                        chunk = os.read(key.fd, _READ_CHUNK_SIZE)
+                        if chunk:
+                            capture.feed(chunk)
+                        else:
+                            selector.unregister(key.fd)
+                            capture.finish()
+            finally:
+                for capture in captures:
+                    capture.finish()
+
+    @staticmethod
+    def _wait_process(process, timeout):
+        """Like process.wait(timeout), but blocks on a pidfd instead of polling where available."""
+        if timeout is None or not _HAS_PIDFD or not isinstance(process, _POPEN_TYPE):
+            return process.wait(timeout=timeout)
         try:
-            for line in iter(stream.readline, ""):
-                sink.append(line)
-                if color:
-                    print(colored(line.rstrip("\n"), color))
-                else:
-                    print(line, end="")
+            pidfd = os.pidfd_open(process.pid)
+        except OSError:
+            return process.wait(timeout=timeout)
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(pidfd, selectors.EVENT_READ)
+                if not selector.select(timeout):
+                    raise subprocess.TimeoutExpired(process.args, timeout)
         finally:
-            stream.close()
+            os.close(pidfd)
+        return process.wait()
 
     @staticmethod
     def _terminate_process_tree(process):
         if process.poll() is not None:
             return
 
-        if os.name == "posix":
+        if _IS_POSIX:
+            # Ask the whole group to exit first so commands can flush output,
+            # then SIGKILL whatever is left (including children that outlive
+            # the shell and would otherwise hold the output pipes open).
             try:
-                os.killpg(process.pid, signal.SIGKILL)
+                os.killpg(process.pid, signal.SIGTERM)
             except ProcessLookupError:
                 return
             except OSError:
                 process.kill()
+                return
+            try:
+                CommandHelper._wait_process(process, _TERMINATE_GRACE_SECONDS)
+            except subprocess.TimeoutExpired:
+                pass
+            finally:
+                # Runs even when a second Ctrl+C cuts the grace period short:
+                # survivors would keep the output pipes (and the readers) open.
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
             return
 
-        if os.name == "nt":
+        if _IS_WINDOWS and _TASKKILL_PATH is not None:
             subprocess.run(
-                ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                [_TASKKILL_PATH, "/F", "/T", "/PID", str(process.pid)],
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.DEVNULL,
                 check=False,
@@ -267,36 +603,22 @@ class CommandHelper:
 
     @staticmethod
     def run_shell_command(command):
-        popen_kwargs = {
-            "args": command,
-            "shell": True,
-            "stdout": subprocess.PIPE,
-            "stderr": subprocess.PIPE,
-            "text": True,
-            "universal_newlines": True,
-        }
-
-        if os.name == "posix":
-            popen_kwargs["start_new_session"] = True
-        elif os.name == "nt":
-            popen_kwargs["creationflags"] = getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
-
-        process = subprocess.Popen(**popen_kwargs)
-        stdout_lines = []
-        stderr_lines = []
-
-        stdout_thread = threading.Thread(
-            target=CommandHelper._read_stream,
-            args=(process.stdout, stdout_lines),
-            daemon=True,
-        )
-        stderr_thread = threading.Thread(
-            target=CommandHelper._read_stream,
-            args=(process.stderr, stderr_lines, "red"),
-            daemon=True,
-        )
-        stdout_thread.start()
-        stderr_thread.start()
+        process = subprocess.Popen(command, **_BASE_POPEN_KWARGS)
+        stdout_capture = _StreamCapture(process.stdout)
+        stderr_capture = _StreamCapture(process.stderr, "red")
+
+        # One selector thread serves both pipes on POSIX; Windows pipes cannot
+        # be polled, so each gets its own blocking reader there.
+        if _IS_POSIX:
+            reader_groups = ((stdout_capture, stderr_capture),)
+        else:
+            reader_groups = ((stdout_capture,), (stderr_capture,))
+        readers = [
+            threading.Thread(target=CommandHelper._read_streams, args=(group,), daemon=True)
+            for group in reader_groups
+        ]
+        for reader in readers:
+            reader.start()
 
         timeout_seconds = CommandHelper._command_timeout_seconds()
         timed_out = False
@@ -306,7 +628,7 @@ class CommandHelper:
             if timeout_seconds is None:
                 returncode = process.wait()
             else:
-                returncode = process.wait(timeout=timeout_seconds)
+                returncode = CommandHelper._wait_process(process, timeout_seconds)
         except subprocess.TimeoutExpired:
             timed_out = True
             CommandHelper._terminate_process_tree(process)
@@ -323,13 +645,13 @@ class CommandHelper:
             returncode = process.wait()
             print(colored("Command interrupted by user", "yellow"))
         finally:
-            stdout_thread.join()
-            stderr_thread.join()
+            for reader in readers:
+                reader.join()
 
         output = {
             "command": command,
-            "stdout": CommandHelper.redact_sensitive_text("".join(stdout_lines)),
-            "stderr": CommandHelper.redact_sensitive_text("".join(stderr_lines)),
+            "stdout": stdout_capture.redacted_text(),
+            "stderr": stderr_capture.redacted_text(),
             "returncode": returncode,
             "timed_out": timed_out,
             "interrupted": interrupted,
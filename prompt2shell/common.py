@@ -23,13 +23,23 @@ THEME_ATTRS_MAP = {
 }
 
 
+# (termcolor color, default attrs) per theme color, resolved once.
+_THEME = {
+    key: (THEME_COLOR_MAP.get(key, key), THEME_ATTRS_MAP.get(key))
+    for key in THEME_COLOR_MAP.keys() | THEME_ATTRS_MAP.keys()
+}
+
+
 def colored(text, color=None, on_color=None, attrs=None):
     mapped_color = color
     if isinstance(color, str):
-        color_key = color.lower()
-        mapped_color = THEME_COLOR_MAP.get(color_key, color_key)
+        theme = _THEME.get(color)
+        if theme is None:
+            color_key = color.lower()
+            theme = _THEME.get(color_key, (color_key, None))
+        mapped_color, default_attrs = theme
         if attrs is None:
-            attrs = THEME_ATTRS_MAP.get(color_key)
+            attrs = default_attrs
     return term_colored(text, mapped_color, on_color=on_color, attrs=attrs)
 
 
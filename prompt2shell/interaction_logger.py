@@ -1,16 +1,29 @@
-import json
+import atexit
 import os
+import queue
 import sys
 import threading
 from datetime import datetime, timezone
 
+import orjson
+
 from .command_helper import CommandHelper
 from .common import colored, env_flag
 
 
+# Logged payloads can carry non-string keys, which json.dumps stringified.
+_DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
 class InteractionLogger:
     """Helper class for logging user queries and assistant responses."""
 
+    # Entries are written by a background thread in batches of up to this
+    # many; entries arriving within BATCH_WINDOW_SECONDS of each other share a
+    # write, and identical consecutive events in a batch are coalesced.
+    FLUSH_THRESHOLD = 64
+    BATCH_WINDOW_SECONDS = 0.05
+
     def __init__(self, log_file=None, enabled=None):
         app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         default_path = os.path.join(app_dir, "logs", "prompt2shell.log")
@@ -26,6 +39,8 @@ class InteractionLogger:
 
         self.log_file = resolved_path
         self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._fd = None
 
         if not self.enabled:
             return
@@ -37,36 +52,137 @@ class InteractionLogger:
             except OSError as exc:
                 print(colored(f"Warning: unable to create log directory: {exc}", "yellow"), file=sys.stderr)
 
+        self._writer = threading.Thread(target=self._drain_forever, name="prompt2shell-log", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
     @staticmethod
     def _sanitize_for_log(value):
+        if isinstance(value, (dict, list, tuple)):
+            # One scan of the serialized payload; most payloads hold nothing
+            # secret-looking. Callers keep mutating their payloads after
+            # logging, so the entry gets a snapshot decoded from those same
+            # bytes rather than the live object.
+            try:
+                serialized = orjson.dumps(value, option=_DUMPS_OPTIONS)
+            except TypeError:
+                serialized = None
+            if serialized is not None and not CommandHelper.may_need_redaction(serialized):
+                return orjson.loads(serialized)
+        return InteractionLogger._redact_for_log(value)
+
+    @staticmethod
+    def _redact_for_log(value):
         if isinstance(value, str):
-            return CommandHelper.redact_sensitive_text(value)
+            return CommandHelper.redact_sensitive_text_cached(value)
         if isinstance(value, dict):
-            return {str(key): InteractionLogger._sanitize_for_log(item) for key, item in value.items()}
+            return {str(key): InteractionLogger._redact_for_log(item) for key, item in value.items()}
         if isinstance(value, list):
-            return [InteractionLogger._sanitize_for_log(item) for item in value]
+            return [InteractionLogger._redact_for_log(item) for item in value]
         if isinstance(value, tuple):
-            return [InteractionLogger._sanitize_for_log(item) for item in value]
+            return [InteractionLogger._redact_for_log(item) for item in value]
         return value
 
-    def _write_entry(self, entry):
-        if not self.enabled:
+    def _open_log_fd(self):
+        # Opened once and kept for the logger's lifetime; O_APPEND makes each
+        # os.write land at the end of the file.
+        flags = os.O_APPEND | os.O_CREAT | os.O_WRONLY
+        file_descriptor = os.open(self.log_file, flags, 0o600)
+        try:
+            os.fchmod(file_descriptor, 0o600)
+        except OSError:
+            pass
+        return file_descriptor
+
+    def _write_entries(self, entries):
+        if not self.enabled or not entries:
             return
 
-        flags = os.O_APPEND | os.O_CREAT | os.O_WRONLY
-        with self._lock:
-            file_descriptor = os.open(self.log_file, flags, 0o600)
+        lines = []
+        for entry in entries:
+            # One bad entry must not cost the rest of the batch; it is
+            # replaced by a marker naming the failure.
             try:
-                os.fchmod(file_descriptor, 0o600)
-            except OSError:
-                pass
+                lines.append(self._serialize_entry(entry))
+            except Exception as exc:  # pylint: disable=broad-except
+                print(colored(f"Warning: unable to log entry: {exc}", "yellow"), file=sys.stderr)
+                marker = {
+                    "timestamp": entry.get("timestamp"),
+                    "type": "event",
+                    "event": "log_entry_dropped",
+                    "data": {"error": f"{type(exc).__name__}: {exc}"},
+                }
+                lines.append(orjson.dumps(marker, option=_DUMPS_OPTIONS) + b"\n")
+        payload = b"".join(lines)
+        if self._fd is None:
+            self._fd = self._open_log_fd()
+        view = memoryview(payload)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+
+    @staticmethod
+    def _serialize_entry(entry):
+        # Message text is immutable, so its redaction is deferred to this
+        # thread; event payloads were sanitized when they were logged.
+        if "text" in entry:
+            entry["text"] = CommandHelper.redact_sensitive_text_cached(entry["text"])
+        return orjson.dumps(entry, option=_DUMPS_OPTIONS) + b"\n"
+
+    @staticmethod
+    def _coalesce(entries):
+        batch = []
+        for entry in entries:
+            last = batch[-1] if batch else None
+            if (
+                last is not None
+                and entry.get("type") == "event"
+                and last.get("type") == "event"
+                and last["event"] == entry["event"]
+                and last["data"] == entry["data"]
+            ):
+                last["repeat"] = last.get("repeat", 1) + 1
+            else:
+                batch.append(entry)
+        return batch
+
+    def _drain_forever(self):
+        while True:
+            entries = [self._queue.get()]
+            while len(entries) < self.FLUSH_THRESHOLD:
+                try:
+                    entries.append(self._queue.get(timeout=self.BATCH_WINDOW_SECONDS))
+                except queue.Empty:
+                    break
             try:
-                file_handle = os.fdopen(file_descriptor, "a", encoding="utf-8")
-            except Exception:
-                os.close(file_descriptor)
-                raise
-            with file_handle:
-                file_handle.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                with self._lock:
+                    self._write_entries(self._coalesce(entries))
+            except Exception as exc:  # pylint: disable=broad-except
+                # Any failure (I/O, serialization, redaction) must not end the
+                # writer: flush() and close() wait for it to drain the queue.
+                print(colored(f"Warning: unable to write log: {exc}", "yellow"), file=sys.stderr)
+            finally:
+                for _ in entries:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Blocks until every entry logged so far has been written."""
+        if not self.enabled:
+            return
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._fd is not None:
+                try:
+                    os.close(self._fd)
+                except OSError:
+                    pass
+                self._fd = None
+
+    def _enqueue(self, entry):
+        self._queue.put(entry)
 
     def log(self, role, text):
         if not self.enabled:
@@ -77,19 +193,18 @@ class InteractionLogger:
         entry = {
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "role": role,
-            "text": self._sanitize_for_log(text),
+            "text": text,
         }
-
-        try:
-            self._write_entry(entry)
-        except OSError as exc:
-            print(colored(f"Warning: unable to write log: {exc}", "yellow"), file=sys.stderr)
+        self._enqueue(entry)
 
     def log_event(self, event_name, data=None):
+        """Logs an event; `data` may be a zero-argument callable, only called when logging is enabled."""
         if not self.enabled:
             return
         if not isinstance(event_name, str) or event_name.strip() == "":
             return
+        if callable(data):
+            data = data()
 
         entry = {
             "timestamp": datetime.now(timezone.utc).isoformat(),
@@ -97,8 +212,4 @@ class InteractionLogger:
             "event": event_name,
             "data": self._sanitize_for_log(data),
         }
-
-        try:
-            self._write_entry(entry)
-        except OSError as exc:
-            print(colored(f"Warning: unable to write log: {exc}", "yellow"), file=sys.stderr)
+        self._enqueue(entry)
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+
+from .command_helper import CommandHelper
+
+
+DEFAULT_CACHE_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MEMORY_ENTRIES = 128
+DEFAULT_SIMILARITY_THRESHOLD = 0.92
+# Recent prompts remembered per cache scope for near-duplicate lookups.
+PROMPT_INDEX_SIZE = 64
+
+_PROMPT_TOKEN_RE = re.compile(r"[^\s\"'`,;:!?()]+")
+# Filler words that do not change which commands a request needs.
+_PROMPT_STOP_WORDS = frozenset("a an the please can could would want need of for with here there".split())
+# Words that set the scope of a request ("all logs" vs "this log", "my
+# processes" vs every process); they are critical, never ignored.
+_PROMPT_SCOPE_WORDS = frozenset(
+    "all any some each every no none only other this that these those my mine our ours your their his her its "
+    "current".split()
+)
+# Prepositions that give the following word a role (source, destination,
+# location). They are bound to that word, so "from /srv to /backup" and
+# "from /backup to /srv" never look alike.
+_PROMPT_ROLE_WORDS = {
+    "from": "from",
+    "to": "to",
+    "into": "to",
+    "onto": "to",
+    "in": "in",
+    "on": "in",
+    "at": "in",
+    "under": "in",
+    "inside": "in",
+    "within": "in",
+}
+_PROMPT_SYNONYMS = {
+    "list": "show",
+    "display": "show",
+    "print": "show",
+    "view": "show",
+    "folder": "directory",
+    "dir": "directory",
+}
+
+
+def _is_critical_token(token):
+    return token in _PROMPT_SCOPE_WORDS or token[0] in "-~./" or "/" in token or "." in token or "*" in token or any(char.isdigit() for char in token)
+
+
+def _normalize_word(token):
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        token = token[:-1]
+    return _PROMPT_SYNONYMS.get(token, token)
+
+
+def prompt_signature(prompt):
+    """Reduces a prompt to (content words, critical tokens) for near-duplicate matching.
+
+    Paths, file names, flags, globs, scope words ("all", "this", "my") and
+    anything containing a digit are critical, as is every preposition bound
+    to its object ("from /srv").
+    Critical tokens are kept in order and must match exactly, so "files in
+    /tmp" never reuses "files in /var" and "copy a b" never reuses "copy b a".
+    """
+    tokens = [token.rstrip(".") for token in _PROMPT_TOKEN_RE.findall(prompt.lower())]
+    tokens = [token for token in tokens if token]
+    content = set()
+    critical = []
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        index += 1
+        role = _PROMPT_ROLE_WORDS.get(token)
+        if role is not None:
+            while index < len(tokens) and tokens[index] in _PROMPT_STOP_WORDS:
+                index += 1
+            target = tokens[index] if index < len(tokens) else ""
+            index += 1
+            if target and not _is_critical_token(target):
+                target = _normalize_word(target)
+            critical.append(f"{role} {target}")
+            continue
+        if _is_critical_token(token):
+            critical.append(token)
+            continue
+        if token in _PROMPT_STOP_WORDS:
+            continue
+        content.add(_normalize_word(token))
+    return frozenset(content), tuple(critical)
+
+
+def prompt_similarity(left, right):
+    """Jaccard similarity of two prompt signatures; 0.0 unless critical tokens are identical."""
+    left_content, left_critical = left
+    right_content, right_critical = right
+    if left_critical != right_critical or not left_content or not right_content:
+        return 0.0
+    return len(left_content & right_content) / len(left_content | right_content)
+
+
+class MemoryBackend:
+    """Keeps the most recently used entries in process memory."""
+
+    def __init__(self, max_entries=DEFAULT_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+
+class FileBackend:
+    """Stores one private JSON file per entry, so cached answers survive across runs."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, entry):
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as handle:
+                json.dump(entry, handle, ensure_ascii=False)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+
+class LLMCache:
+    """Cache of model answers keyed by a hash of everything sent with the prompt.
+
+    Exact keys are checked first; with a similarity threshold set, prompts that
+    differ only in filler words or synonyms can reuse a remembered answer.
+    """
+
+    def __init__(self, backend, ttl_seconds=DEFAULT_CACHE_TTL_SECONDS, similarity_threshold=None):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        # None disables near-duplicate lookups; only exact keys can hit.
+        self.similarity_threshold = similarity_threshold
+
+    @staticmethod
+    def default_directory():
+        cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(cache_home, "prompt2shell", "responses")
+
+    @classmethod
+    def from_env(cls):
+        """Builds the cache selected by PROMPT2SHELL_CACHE, or returns None when caching is off."""
+        mode = str(os.getenv("PROMPT2SHELL_CACHE", "off")).strip().lower()
+        if mode in {"", "0", "false", "off", "no"}:
+            return None
+
+        raw_ttl = os.getenv("PROMPT2SHELL_CACHE_TTL", str(DEFAULT_CACHE_TTL_SECONDS))
+        try:
+            ttl_seconds = int(raw_ttl)
+        except (TypeError, ValueError):
+            ttl_seconds = DEFAULT_CACHE_TTL_SECONDS
+
+        raw_threshold = os.getenv("PROMPT2SHELL_CACHE_SIMILARITY", str(DEFAULT_SIMILARITY_THRESHOLD))
+        try:
+            similarity_threshold = float(raw_threshold)
+        except (TypeError, ValueError):
+            similarity_threshold = DEFAULT_SIMILARITY_THRESHOLD
+        if similarity_threshold <= 0:
+            similarity_threshold = None
+
+        if mode == "memory":
+            backend = MemoryBackend()
+        else:
+            directory = os.path.expanduser(os.getenv("PROMPT2SHELL_CACHE_DIR") or cls.default_directory())
+            backend = FileBackend(directory)
+        return cls(backend, ttl_seconds, similarity_threshold)
+
+    @staticmethod
+    def cache_key(**parts):
+        serialized = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        entry = self.backend.get(key)
+        if not isinstance(entry, dict) or "value" not in entry:
+            return None
+        expires_at = entry.get("expires_at")
+        if isinstance(expires_at, (int, float)) and expires_at <= time.time():
+            self.backend.delete(key)
+            return None
+        # Values are stored serialized, so callers always get a private copy.
+        try:
+            return json.loads(entry["value"])
+        except (TypeError, ValueError):
+            return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds > 0 else None
+        self.backend.set(key, {"expires_at": expires_at, "value": json.dumps(value, ensure_ascii=False)})
+
+    def find_similar(self, index_key, prompt):
+        """Returns the cached value of the closest remembered prompt above the threshold, or None."""
+        if self.similarity_threshold is None:
+            return None
+        index = self.get(index_key)
+        if not isinstance(index, list):
+            return None
+
+        # Stored prompts are redacted, so compare against the redacted form.
+        signature = prompt_signature(CommandHelper.redact_sensitive_text(prompt))
+        best_key = None
+        best_score = self.similarity_threshold
+        for item in index:
+            if not isinstance(item, dict):
+                continue
+            score = prompt_similarity(signature, prompt_signature(str(item.get("prompt", ""))))
+            if score >= best_score:
+                best_key, best_score = item.get("key"), score
+        return self.get(best_key) if isinstance(best_key, str) else None
+
+    def remember_prompt(self, index_key, prompt, key):
+        """Records that `key` answers `prompt`, making it reachable from near-duplicate prompts."""
+        if self.similarity_threshold is None:
+            return
+        index = self.get(index_key)
+        if not isinstance(index, list):
+            index = []
+        index = [item for item in index if isinstance(item, dict) and item.get("key") != key]
+        # The index may be written to disk; never persist secrets from prompts.
+        index.append({"prompt": CommandHelper.redact_sensitive_text(prompt), "key": key})
+        self.set(index_key, index[-PROMPT_INDEX_SIZE:])
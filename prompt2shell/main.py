@@ -7,32 +7,57 @@ from .application import Application
 from .command_helper import CommandHelper
 from .common import env_flag
 from .interaction_logger import InteractionLogger
-from .openai_helper import OpenAIHelper
 
 
 LS_LONG_ENTRY_PATTERN = re.compile(r"^[bcdlps-][rwxstST-]{9}\s+")
 
 
-def read_piped_input():
-    stdin = getattr(sys, "stdin", None)
-    if stdin is None:
-        return None
+PIPE_READ_CHUNK_BYTES = 64 * 1024
+DEFAULT_PIPE_MAX_BYTES = 2 * 1024 * 1024
+
+
+def _read_pipe_max_bytes():
+    raw_value = os.getenv("PROMPT2SHELL_PIPE_MAX_BYTES", str(DEFAULT_PIPE_MAX_BYTES))
     try:
-        if stdin.isatty():
-            return None
-    except (AttributeError, OSError):
-        return None
+        max_bytes = int(raw_value)
+    except (TypeError, ValueError):
+        max_bytes = DEFAULT_PIPE_MAX_BYTES
+    return max_bytes if max_bytes > 0 else None
+
 
+def _read_capped(binary_stream, max_bytes):
+    """Reads up to `max_bytes` in chunks; returns (data, truncated)."""
+    data = bytearray()
+    # One byte past the cap tells a full pipe apart from an exact fit.
+    while max_bytes is None or len(data) <= max_bytes:
+        size = PIPE_READ_CHUNK_BYTES if max_bytes is None else min(PIPE_READ_CHUNK_BYTES, max_bytes + 1 - len(data))
+        chunk = binary_stream.read(size)
+        if not chunk:
+            return data, False
+        data += chunk
+
+    del data[max_bytes:]
+    last_newline = data.rfind(b"\n")
+    if last_newline > 0:
+        del data[last_newline:]
+    return data, True
+
+
+def read_piped_input():
+    max_bytes = _read_pipe_max_bytes()
     try:
-        piped_text = stdin.read()
-    except OSError:
+        stdin = sys.stdin
+        if stdin is None or stdin.isatty():
+            return None
+        data, truncated = _read_capped(stdin.buffer, max_bytes)
+    except (AttributeError, OSError, ValueError):
         return None
 
-    if not isinstance(piped_text, str):
-        return None
-    piped_text = piped_text.strip()
-    if piped_text == "":
+    piped_text = data.strip().decode("utf-8", errors="replace")
+    if not piped_text:
         return None
+    if truncated:
+        piped_text = f"{piped_text}\n...[piped input truncated at {max_bytes} bytes]"
     return piped_text
 
 
@@ -50,8 +75,7 @@ def infer_piped_source_description(piped_text):
     except (json.JSONDecodeError, TypeError, ValueError):
         pass
 
-    long_ls_entries = sum(1 for line in lines if LS_LONG_ENTRY_PATTERN.match(line))
-    if first_line.startswith("total ") and long_ls_entries >= 1:
+    if first_line.startswith("total ") and any(LS_LONG_ENTRY_PATTERN.match(line) for line in lines):
         return "likely `ls -l` or `ll` output (detailed directory listing)"
 
     if first_line.startswith("Filesystem") and ("Mounted on" in first_line or "Use%" in first_line):
@@ -63,13 +87,19 @@ def infer_piped_source_description(piped_text):
     if first_line.startswith("On branch ") or "nothing to commit" in piped_text:
         return "likely `git status` output"
 
-    simple_name_lines = 0
-    for line in lines:
-        if " " in line or "\t" in line:
-            continue
-        simple_name_lines += 1
-    if len(lines) >= 3 and simple_name_lines / len(lines) >= 0.7:
-        return "likely `ls` output (list of names)"
+    if len(lines) >= 3:
+        # Stop as soon as the 70% threshold is either reached or out of reach.
+        needed = 0.7 * len(lines)
+        simple_name_lines = 0
+        remaining = len(lines)
+        for line in lines:
+            if simple_name_lines >= needed or simple_name_lines + remaining < needed:
+                break
+            remaining -= 1
+            if " " not in line and "\t" not in line:
+                simple_name_lines += 1
+        if simple_name_lines >= needed:
+            return "likely `ls` output (list of names)"
 
     return "shell command output"
 
@@ -93,6 +123,9 @@ def build_prompt_from_pipe(user_prompt, piped_input):
 
 
 def build_application():
+    # Deferred: importing the OpenAI SDK is the most expensive part of startup.
+    from .openai_helper import OpenAIHelper  # pylint: disable=import-outside-toplevel
+
     max_output_tokens_raw = os.getenv("PROMPT2SHELL_MAX_OUTPUT_TOKENS", "1200")
     try:
         max_output_tokens = int(max_output_tokens_raw)
@@ -115,9 +148,7 @@ def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
 
-    initial_prompt = " ".join(argv).strip() if argv else None
-    if initial_prompt == "":
-        initial_prompt = None
+    initial_prompt = " ".join(argv).strip() or None
 
     piped_input = read_piped_input()
     if piped_input is not None:
@@ -125,14 +156,20 @@ def main(argv=None):
 
     once_mode = env_flag("PROMPT2SHELL_ONCE", False)
     app = build_application()
-    configure_context = getattr(getattr(app, "openai_helper", None), "configure_session_context", None)
+    openai_helper = getattr(app, "openai_helper", None)
+    configure_context = getattr(openai_helper, "configure_session_context", None)
     if callable(configure_context):
         configure_context(
             once_mode=once_mode,
             has_piped_input=piped_input is not None,
         )
 
-    app.run(initial_prompt=initial_prompt, exit_after_initial_prompt=once_mode)
+    try:
+        app.run(initial_prompt=initial_prompt, exit_after_initial_prompt=once_mode)
+    finally:
+        close_client = getattr(openai_helper, "close", None)
+        if callable(close_client):
+            close_client()
 
 
 if __name__ == "__main__":
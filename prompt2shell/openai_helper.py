@@ -1,12 +1,118 @@
-import json
 import os
 import sys
+import threading
+from dataclasses import asdict, dataclass
+from types import MappingProxyType
 
-from openai import OpenAI
+import httpx
+import orjson
+from openai import DefaultHttpxClient, OpenAI
 
 from .common import colored
+from .llm_cache import LLMCache
 from .os_helper import OSHelper
 
+DEFAULT_API_MAX_RETRIES = 4
+DEFAULT_API_TIMEOUT_SECONDS = 120.0
+
+# Turns are strictly sequential, so a couple of pooled connections suffice.
+# httpx drops idle connections after 5 s by default, which is shorter than a
+# typical pause between prompts and would cost a new TLS handshake per turn.
+_HTTP_POOL_LIMITS = httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=90.0)
+
+# The instructions' base text and the tool schema are identical for every
+# helper and every request; they are shared and never mutated.
+_BASE_INSTRUCTIONS = (
+    "You are a shell command assistant. Prefer safe, idempotent commands first. "
+    "Prefer read-only inspection commands unless change is clearly required. "
+    "For any command proposal, return it through the get_commands function. "
+    "Include a short description for each command. "
+    "If no command is needed, return an empty commands list with a helpful response."
+)
+
+_TOOLS = [
+    {
+        "type": "function",
+        "name": "get_commands",
+        "description": "Return a list of shell commands for the user's machine",
+        "strict": False,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "commands": {
+                    "type": "array",
+                    "description": "List of shell commands to execute",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "command": {
+                                "type": "string",
+                                "description": "A valid command string",
+                            },
+                            "description": {
+                                "type": "string",
+                                "description": "Description of the command",
+                            },
+                        },
+                        "required": ["command"],
+                        "additionalProperties": False,
+                    },
+                },
+                "response": {
+                    "type": "string",
+                    "description": "Human-readable explanation for the user",
+                },
+            },
+            "required": ["commands", "response"],
+            "additionalProperties": False,
+        },
+    }
+]
+
+# Forces the model to answer through the get_commands function; shared, never mutated.
+_FORCED_TOOL_CHOICE = {"type": "function", "name": "get_commands"}
+
+# Prompts wrapped around the JSON execution report, pre-encoded for joining with orjson output.
+_FOLLOW_UP_REPORT_PREFIX = (
+    b"Analyze the following shell execution report and explain what happened. "
+    b"If useful, propose next steps via get_commands. "
+    b"If nothing was executed, clearly state that and do not propose follow-up commands.\n\n"
+    b"Execution report:\n"
+)
+_ANALYSIS_ONLY_REPORT_PREFIX = (
+    b"Analyze the following shell execution report and explain what happened. "
+    b"Do not propose or return any new commands. "
+    b"Do not call get_commands. "
+    b"Provide only an explanation for the user.\n\n"
+    b"Execution report:\n"
+)
+
+# Stream events that carry the finished Response object.
+_FINAL_STREAM_EVENTS = frozenset(("response.completed", "response.incomplete"))
+
+
+class _TurnCancelled(Exception):
+    """Raised inside a worker whose turn was cancelled, so its late response is dropped."""
+
+
+@dataclass(slots=True)
+class UsageSummary:
+    """Token and call counters for one helper call or a whole session."""
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+    api_calls: int = 0
+
+    def add(self, other):
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.total_tokens += other.total_tokens
+        self.api_calls += other.api_calls
+
+    def as_dict(self):
+        return asdict(self)
+
 
 class OpenAIHelper:
     """A class that handles OpenAI Responses API calls."""
@@ -18,23 +124,38 @@ class OpenAIHelper:
             print(colored("Error: OPENAI_API_KEY is not set", "red"), file=sys.stderr)
             raise SystemExit(1)
 
-        self.client = OpenAI(api_key=self.api_key)
+        # The SDK retries rate limits, timeouts, connection errors and 5xx with
+        # jittered exponential backoff, honoring Retry-After when present.
+        self.client = OpenAI(
+            api_key=self.api_key,
+            max_retries=self._read_max_retries_from_env(),
+            timeout=self._read_timeout_from_env(),
+            http_client=DefaultHttpxClient(limits=_HTTP_POOL_LIMITS),
+        )
         self.model_name = model_name
         self.max_output_tokens = max_output_tokens
         self.last_response_id = None
+        # function_call_output items owed to last_response_id; see _resolve_function_calls.
+        self._pending_tool_outputs = None
+        # Turns answered from the response cache never reached the server;
+        # they are replayed ahead of the input that starts the chain.
+        self._cached_turns = []
+        # Each request continues the previous one via previous_response_id, so
+        # turns must not overlap; the application issues them from a worker
+        # thread while the UI thread keeps the progress indicator running.
+        self._conversation_lock = threading.Lock()
+        # Bumped by cancel_pending_turn(); a turn that started under an older
+        # generation drops its response instead of updating the conversation.
+        self._turn_generation = 0
+        self._active_generation = 0
         self.interaction_logger = interaction_logger
+        self.response_cache = LLMCache.from_env()
         self.last_usage_summary = None
-        self.session_usage_summary = self._empty_usage_summary()
+        self.session_usage_summary = UsageSummary()
         self._active_usage_summary = None
 
         self.os_name, self.shell_name = OSHelper.get_os_and_shell_info()
-        self.base_instructions = (
-            "You are a shell command assistant. Prefer safe, idempotent commands first. "
-            "Prefer read-only inspection commands unless change is clearly required. "
-            "For any command proposal, return it through the get_commands function. "
-            "Include a short description for each command. "
-            "If no command is needed, return an empty commands list with a helpful response."
-        )
+        self.base_instructions = _BASE_INSTRUCTIONS
         self.chat_language = self._normalize_chat_language(
             os.getenv("PROMPT2SHELL_CHAT_LANGUAGE", "english")
         )
@@ -42,47 +163,25 @@ class OpenAIHelper:
         self.session_has_piped_input = False
         self.session_safe_mode_enabled = True
         self.session_strict_safe_mode = False
+        # Sent as a message rather than baked into the instructions or tool
+        # schema, which stay byte-identical across machines and sessions so the
+        # server-side prompt prefix cache keeps hitting.
+        self.environment_context = (
+            f"Environment: commands run in {self.shell_name or 'the default'} shell on an {self.os_name} machine."
+        )
 
-        self.tools = [
+        self.tools = _TOOLS
+        # Request fields that never change for this helper; each call copies it.
+        self._base_request = MappingProxyType(
             {
-                "type": "function",
-                "name": "get_commands",
-                "description": (
-                    f"Return a list of {self.shell_name} commands for an {self.os_name} machine"
-                ),
-                "strict": False,
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "commands": {
-                            "type": "array",
-                            "description": "List of shell commands to execute",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "command": {
-                                        "type": "string",
-                                        "description": "A valid command string",
-                                    },
-                                    "description": {
-                                        "type": "string",
-                                        "description": "Description of the command",
-                                    },
-                                },
-                                "required": ["command"],
-                                "additionalProperties": False,
-                            },
-                        },
-                        "response": {
-                            "type": "string",
-                            "description": "Human-readable explanation for the user",
-                        },
-                    },
-                    "required": ["commands", "response"],
-                    "additionalProperties": False,
-                },
+                "model": self.model_name,
+                "tools": self.tools,
+                "parallel_tool_calls": False,
+                "max_output_tokens": self.max_output_tokens,
             }
-        ]
+        )
+        self._instructions_key = None
+        self._instructions = None
 
     def configure_session_context(
         self,
@@ -100,6 +199,20 @@ class OpenAIHelper:
         if strict_safe_mode is not None:
             self.session_strict_safe_mode = bool(strict_safe_mode)
 
+    def _current_instructions(self):
+        """Returns the instructions, rebuilding them only after the session context changed."""
+        key = (
+            self.session_strict_safe_mode,
+            self.session_safe_mode_enabled,
+            self.session_has_piped_input,
+            self.session_once_mode,
+            self.chat_language,
+        )
+        if key != self._instructions_key:
+            self._instructions = self._build_instructions()
+            self._instructions_key = key
+        return self._instructions
+
     def _build_instructions(self):
         instructions_parts = [self.base_instructions]
 
@@ -145,6 +258,24 @@ class OpenAIHelper:
             return item.get(key, default)
         return getattr(item, key, default)
 
+    @staticmethod
+    def _read_max_retries_from_env():
+        raw_value = os.getenv("PROMPT2SHELL_API_MAX_RETRIES", str(DEFAULT_API_MAX_RETRIES))
+        try:
+            max_retries = int(raw_value)
+        except (TypeError, ValueError):
+            max_retries = DEFAULT_API_MAX_RETRIES
+        return max(0, max_retries)
+
+    @staticmethod
+    def _read_timeout_from_env():
+        raw_value = os.getenv("PROMPT2SHELL_API_TIMEOUT", str(DEFAULT_API_TIMEOUT_SECONDS))
+        try:
+            timeout = float(raw_value)
+        except (TypeError, ValueError):
+            timeout = DEFAULT_API_TIMEOUT_SECONDS
+        return timeout if timeout > 0 else DEFAULT_API_TIMEOUT_SECONDS
+
     @staticmethod
     def _normalize_chat_language(raw_language):
         normalized = str(raw_language or "").strip().lower()
@@ -152,72 +283,155 @@ class OpenAIHelper:
             return "polish"
         return "english"
 
-    @staticmethod
-    def _empty_usage_summary():
-        return {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "api_calls": 0}
-
     @staticmethod
     def _safe_int(value):
+        # SDK usage counters are already ints; skip the conversion for them.
+        if type(value) is int:  # pylint: disable=unidiomatic-typecheck
+            return value
         try:
             return int(value)
         except (TypeError, ValueError):
             return 0
 
     def _begin_usage_capture(self):
-        self._active_usage_summary = self._empty_usage_summary()
+        self._active_usage_summary = UsageSummary()
 
     def _finish_usage_capture(self):
-        if self._active_usage_summary is None:
-            self.last_usage_summary = None
-        else:
-            self.last_usage_summary = dict(self._active_usage_summary)
+        self.last_usage_summary = self._active_usage_summary
         self._active_usage_summary = None
         return self.last_usage_summary
 
     def _extract_usage_summary(self, response):
         usage = self._item_value(response, "usage")
         if usage is None:
-            return self._empty_usage_summary()
-        return {
-            "input_tokens": self._safe_int(self._item_value(usage, "input_tokens", 0)),
-            "output_tokens": self._safe_int(self._item_value(usage, "output_tokens", 0)),
-            "total_tokens": self._safe_int(self._item_value(usage, "total_tokens", 0)),
-            "api_calls": 1,
-        }
+            return UsageSummary()
+        # SDK responses carry a Usage model; only hand-built payloads are dicts.
+        get = dict.get if isinstance(usage, dict) else getattr
+        safe_int = self._safe_int
+        return UsageSummary(
+            input_tokens=safe_int(get(usage, "input_tokens", 0)),
+            output_tokens=safe_int(get(usage, "output_tokens", 0)),
+            total_tokens=safe_int(get(usage, "total_tokens", 0)),
+            api_calls=1,
+        )
 
     def _record_usage_summary(self, usage_summary):
-        if not isinstance(usage_summary, dict):
+        if not isinstance(usage_summary, UsageSummary):
             return
-        for key in ("input_tokens", "output_tokens", "total_tokens", "api_calls"):
-            self.session_usage_summary[key] += self._safe_int(usage_summary.get(key, 0))
-            if self._active_usage_summary is not None:
-                self._active_usage_summary[key] += self._safe_int(usage_summary.get(key, 0))
+        self.session_usage_summary.add(usage_summary)
+        if self._active_usage_summary is not None:
+            self._active_usage_summary.add(usage_summary)
 
     def get_last_usage_summary(self):
         if self.last_usage_summary is None:
             return None
-        return dict(self.last_usage_summary)
+        return self.last_usage_summary.as_dict()
 
     def get_session_usage_summary(self):
-        return dict(self.session_usage_summary)
+        return self.session_usage_summary.as_dict()
+
+    def format_usage_line(self):
+        """Return the one-line token usage report for the last call, or None before any call."""
+        usage = self.last_usage_summary
+        if usage is None:
+            return None
+        session = self.session_usage_summary
+        output_left = max(0, self.max_output_tokens - usage.output_tokens)
+        return (
+            f"Tokens last: in={usage.input_tokens}, out={usage.output_tokens}, "
+            f"total={usage.total_tokens}, out_left={output_left}/{self.max_output_tokens} | "
+            f"session: in={session.input_tokens}, out={session.output_tokens}, "
+            f"total={session.total_tokens}, calls={session.api_calls}"
+        )
 
     def _log_api_event(self, event_name, payload):
+        """Logs an event; payload may be a callable, evaluated only if logging is enabled."""
         if self.interaction_logger is None:
             return
         self.interaction_logger.log_event(event_name, payload)
 
-    def _create_response(self, input_data, tool_choice="auto"):
-        request = {
-            "model": self.model_name,
-            "instructions": self._build_instructions(),
-            "input": input_data,
-            "tools": self.tools,
-            "tool_choice": tool_choice,
-            "parallel_tool_calls": False,
-            "max_output_tokens": self.max_output_tokens,
-        }
+    @staticmethod
+    def _consume_response_stream(stream, on_text_delta):
+        """Forwards text deltas as they arrive and returns the final Response object."""
+        final_response = None
+        # Closing the stream on every exit releases its connection; an
+        # abandoned iteration would leave it in the keep-alive pool mid-body.
+        with stream:
+            for event in stream:
+                event_type = getattr(event, "type", None)
+                if event_type == "response.output_text.delta":
+                    on_text_delta(event.delta)
+                elif event_type in _FINAL_STREAM_EVENTS:
+                    final_response = event.response
+                elif event_type == "response.failed":
+                    error = getattr(event.response, "error", None)
+                    raise RuntimeError(f"Response failed: {getattr(error, 'message', None) or 'unknown error'}")
+        if final_response is None:
+            raise RuntimeError("Response stream ended without a final response")
+        return final_response
+
+    def _with_pending_tool_outputs(self, input_data):
+        # The previous response ended with function calls that still need
+        # their outputs before the conversation can continue.
+        if isinstance(input_data, list):
+            return [*self._pending_tool_outputs, *input_data]
+        return [*self._pending_tool_outputs, {"role": "user", "content": input_data}]
+
+    def _with_environment_context(self, input_data):
+        environment_message = {"role": "developer", "content": self.environment_context}
+        if isinstance(input_data, list):
+            return [environment_message, *self._cached_turns, *input_data]
+        return [environment_message, *self._cached_turns, {"role": "user", "content": input_data}]
+
+    def _remember_cached_turn(self, prompt, commands_payload, cache_key):
+        # Replays the cached answer as the get_commands call the model would
+        # have made, so a follow-up still sees the question and the commands.
+        call_id = f"call_cached_{cache_key[:24]}"
+        self._cached_turns.extend(
+            (
+                {"role": "user", "content": prompt},
+                {
+                    "type": "function_call",
+                    "call_id": call_id,
+                    "name": "get_commands",
+                    "arguments": orjson.dumps(commands_payload).decode(),
+                },
+                {
+                    "type": "function_call_output",
+                    "call_id": call_id,
+                    "output": orjson.dumps(
+                        {"status": "ok", "commands_count": len(commands_payload.get("commands") or ())}
+                    ).decode(),
+                },
+            )
+        )
+
+    def cancel_pending_turn(self):
+        """Abandons the call in flight, e.g. after Ctrl+C: it stops streaming and its response is discarded."""
+        self._turn_generation += 1
+
+    def close(self):
+        """Closes the pooled HTTP connections; the helper cannot make requests afterwards."""
+        self.client.close()
+
+    def _raise_if_cancelled(self):
+        if self._active_generation != self._turn_generation:
+            raise _TurnCancelled()
+
+    def _create_response(self, input_data, tool_choice="auto", on_text_delta=None):
+        self._raise_if_cancelled()
+        request = dict(self._base_request)
+        request["instructions"] = self._current_instructions()
+        request["input"] = input_data
+        request["tool_choice"] = tool_choice
         if self.last_response_id is not None:
             request["previous_response_id"] = self.last_response_id
+            if self._pending_tool_outputs:
+                request["input"] = self._with_pending_tool_outputs(input_data)
+        else:
+            # First turn of a chain; later turns inherit the message through
+            # previous_response_id.
+            request["input"] = self._with_environment_context(input_data)
 
         self._log_api_event(
             "api_request",
@@ -225,45 +439,67 @@ class OpenAIHelper:
                 "model": request["model"],
                 "tool_choice": request["tool_choice"],
                 "has_previous_response_id": "previous_response_id" in request,
+                "stream": on_text_delta is not None,
                 "input": input_data,
             },
         )
 
-        response = self.client.responses.create(**request)
+        if on_text_delta is None:
+            response = self.client.responses.create(**request)
+        else:
+
+            def forward_delta(delta):
+                self._raise_if_cancelled()
+                on_text_delta(delta)
+
+            response = self._consume_response_stream(
+                self.client.responses.create(**request, stream=True),
+                forward_delta,
+            )
+        self._raise_if_cancelled()
         self.last_response_id = response.id
+        self._pending_tool_outputs = None
+        self._cached_turns = []
         usage_summary = self._extract_usage_summary(response)
         self._record_usage_summary(usage_summary)
-        output_items = []
-        for item in self._item_value(response, "output", []) or []:
-            output_items.append(
+        self._log_api_event("api_response", lambda: self._response_log_payload(response, usage_summary))
+        return response
+
+    def _response_log_payload(self, response, usage_summary):
+        items, get = self._output_items(response)
+        return {
+            "response_id": response.id,
+            "output_text": self._response_text(response),
+            "output_items": [
                 {
-                    "type": self._item_value(item, "type"),
-                    "id": self._item_value(item, "id"),
-                    "name": self._item_value(item, "name"),
-                    "call_id": self._item_value(item, "call_id"),
+                    "type": get(item, "type", None),
+                    "id": get(item, "id", None),
+                    "name": get(item, "name", None),
+                    "call_id": get(item, "call_id", None),
                 }
-            )
-        self._log_api_event(
-            "api_response",
-            {
-                "response_id": response.id,
-                "output_text": self._response_text(response),
-                "output_items": output_items,
-                "usage": usage_summary,
-            },
-        )
-        return response
+                for item in items
+            ],
+            "usage": usage_summary.as_dict(),
+        }
+
+    def _output_items(self, response):
+        """Returns (output items, field getter), picking dict or attribute access once per response."""
+        items = self._item_value(response, "output", None) or ()
+        if not items:
+            return (), None
+        return items, dict.get if isinstance(items[0], dict) else getattr
 
     def _extract_function_calls(self, response):
+        items, get = self._output_items(response)
         calls = []
-        for item in self._item_value(response, "output", []) or []:
-            if self._item_value(item, "type") != "function_call":
+        for item in items:
+            if get(item, "type", None) != "function_call":
                 continue
-            call_id = self._item_value(item, "call_id") or self._item_value(item, "id")
+            call_id = get(item, "call_id", None) or get(item, "id", None)
             calls.append(
                 {
-                    "name": self._item_value(item, "name"),
-                    "arguments": self._item_value(item, "arguments", "{}"),
+                    "name": get(item, "name", None),
+                    "arguments": get(item, "arguments", "{}"),
                     "call_id": call_id,
                 }
             )
@@ -278,56 +514,66 @@ class OpenAIHelper:
         if not isinstance(commands, list):
             return None
 
+        # One pass mirroring the get_commands schema (which is not strict, so
+        # the server does not enforce it): keep non-blank string commands and
+        # coerce missing or non-string descriptions to "".
         sanitized = []
         for command in commands:
             if not isinstance(command, dict):
                 continue
             command_text = command.get("command")
-            if not isinstance(command_text, str) or command_text.strip() == "":
+            if not isinstance(command_text, str) or not command_text or command_text.isspace():
                 continue
             description = command.get("description")
             sanitized.append(
-                {
-                    "command": command_text,
-                    "description": description if isinstance(description, str) else "",
-                }
+                {"command": command_text, "description": description if isinstance(description, str) else ""}
             )
 
-        return {
-            "commands": sanitized,
-            "response": payload.get("response", "") if isinstance(payload.get("response", ""), str) else "",
-        }
+        response = payload.get("response")
+        return {"commands": sanitized, "response": response if isinstance(response, str) else ""}
 
     @staticmethod
     def _response_text(response):
         text = getattr(response, "output_text", None)
         return text.strip() if isinstance(text, str) and text.strip() else None
 
-    def _resolve_function_calls(self, response):
+    def _resolve_function_calls(self, response, on_text_delta=None, defer_acknowledgement=False):
+        """Answers function calls until the model replies without one.
+
+        With defer_acknowledgement, a turn whose calls were all valid
+        get_commands calls ends right away: its function_call_output items are
+        kept pending and sent ahead of the next request's input instead of
+        costing an extra round trip now.
+        """
         current_response = response
         commands_payload = None
+        # Analysis turns usually come back as plain text: return them untouched.
+        calls = self._extract_function_calls(current_response)
+        if not calls:
+            return current_response, None
 
         for _ in range(3):
-            calls = self._extract_function_calls(current_response)
             if not calls:
                 break
 
             outputs = []
+            all_accepted = True
             for call in calls:
                 if call["name"] != "get_commands":
+                    all_accepted = False
                     if not call["call_id"]:
                         continue
                     outputs.append(
                         {
                             "type": "function_call_output",
                             "call_id": call["call_id"],
-                            "output": json.dumps({"status": "ignored", "reason": "Unsupported function"}),
+                            "output": orjson.dumps({"status": "ignored", "reason": "Unsupported function"}).decode(),
                         }
                     )
                     continue
 
                 try:
-                    parsed = json.loads(call["arguments"])
+                    parsed = orjson.loads(call["arguments"])
                     parsed = self._sanitize_commands_payload(parsed)
                     if parsed is None:
                         raise ValueError("Invalid get_commands payload")
@@ -339,69 +585,133 @@ class OpenAIHelper:
                         {
                             "type": "function_call_output",
                             "call_id": call["call_id"],
-                            "output": json.dumps({"status": "ok", "commands_count": len(parsed["commands"])}),
+                            "output": orjson.dumps({"status": "ok", "commands_count": len(parsed["commands"])}).decode(),
                         }
                     )
                 except Exception as exc:  # pylint: disable=broad-except
+                    all_accepted = False
                     if not call["call_id"]:
                         continue
                     outputs.append(
                         {
                             "type": "function_call_output",
                             "call_id": call["call_id"],
-                            "output": json.dumps({"status": "error", "error": str(exc)}),
+                            "output": orjson.dumps({"status": "error", "error": str(exc)}).decode(),
                         }
                     )
 
-            current_response = self._create_response(outputs, tool_choice="none")
+            if defer_acknowledgement and all_accepted and commands_payload is not None:
+                self._pending_tool_outputs = outputs
+                break
+
+            try:
+                current_response = self._create_response(outputs, tool_choice="none", on_text_delta=on_text_delta)
+            except _TurnCancelled:
+                # last_response_id still points at the calls; the next turn
+                # must answer them or the API rejects the chain.
+                self._pending_tool_outputs = outputs
+                raise
+            calls = self._extract_function_calls(current_response)
 
         return current_response, commands_payload
 
     def get_commands(self, prompt):
         """Return command suggestions using forced function calling."""
+        generation = self._turn_generation
+        with self._conversation_lock:
+            self._active_generation = generation
+            return self._get_commands(prompt)
+
+    def _commands_cache_scope(self, tool_choice):
+        # Only the first prompt of a conversation is cacheable: once
+        # previous_response_id is set, the answer depends on server-side state.
+        if self.response_cache is None or self.last_response_id is not None:
+            return None
+        return {
+            "model": self.model_name,
+            "instructions": self._current_instructions(),
+            "tools": self.tools,
+            "tool_choice": tool_choice,
+            "max_output_tokens": self.max_output_tokens,
+            "os_name": self.os_name,
+            "shell_name": self.shell_name,
+        }
+
+    def _get_commands(self, prompt):
         self._begin_usage_capture()
         try:
-            response = self._create_response(
-                input_data=prompt,
-                tool_choice={"type": "function", "name": "get_commands"},
-            )
-            _, commands_payload = self._resolve_function_calls(response)
+            tool_choice = _FORCED_TOOL_CHOICE
+            cache_scope = self._commands_cache_scope(tool_choice)
+            if cache_scope is not None:
+                cache = self.response_cache
+                cache_key = cache.cache_key(prompt=prompt, **cache_scope)
+                index_key = cache.cache_key(prompt_index=True, **cache_scope)
+                # Cache files are user-writable: hold them to the same schema as
+                # a model answer and treat anything malformed as a miss.
+                cached_payload = self._sanitize_commands_payload(cache.get(cache_key))
+                match = "exact"
+                if cached_payload is None:
+                    cached_payload = self._sanitize_commands_payload(cache.find_similar(index_key, prompt))
+                    match = "similar"
+                if cached_payload is not None:
+                    self._log_api_event("cache_hit", {"key": cache_key, "match": match, "payload": cached_payload})
+                    self._remember_cached_turn(prompt, cached_payload, cache_key)
+                    return cached_payload
+
+            response = self._create_response(input_data=prompt, tool_choice=tool_choice)
+            _, commands_payload = self._resolve_function_calls(response, defer_acknowledgement=True)
+            if cache_scope is not None and commands_payload is not None:
+                cache.set(cache_key, commands_payload)
+                cache.remember_prompt(index_key, prompt, cache_key)
             return commands_payload
+        except _TurnCancelled:
+            return None
         except Exception as exc:  # pylint: disable=broad-except
             print(colored(f"Error: {exc}", "red"), file=sys.stderr)
             return None
         finally:
             self._finish_usage_capture()
 
-    def send_commands_outputs(self, outputs, execution_summary=None, allow_follow_up_commands=True):
-        """Send command outputs for analysis and optional follow-up commands."""
+    def send_commands_outputs(
+        self,
+        outputs,
+        execution_summary=None,
+        allow_follow_up_commands=True,
+        on_text_delta=None,
+    ):
+        """Send command outputs for analysis and optional follow-up commands.
+
+        When on_text_delta is given, the analysis is streamed and the callable
+        receives each chunk of assistant text as soon as it is generated.
+        """
+        generation = self._turn_generation
+        with self._conversation_lock:
+            self._active_generation = generation
+            return self._send_commands_outputs(outputs, execution_summary, allow_follow_up_commands, on_text_delta)
+
+    def _send_commands_outputs(self, outputs, execution_summary, allow_follow_up_commands, on_text_delta):
         self._begin_usage_capture()
         execution_payload = {
             "execution_summary": execution_summary if isinstance(execution_summary, list) else [],
             "outputs": outputs if isinstance(outputs, list) else [],
         }
-        execution_json = json.dumps(execution_payload, ensure_ascii=False)
         if allow_follow_up_commands:
-            prompt_text = (
-                "Analyze the following shell execution report and explain what happened. "
-                "If useful, propose next steps via get_commands. "
-                "If nothing was executed, clearly state that and do not propose follow-up commands.\n\n"
-                f"Execution report:\n{execution_json}"
-            )
+            prompt_prefix = _FOLLOW_UP_REPORT_PREFIX
             tool_choice = "auto"
         else:
-            prompt_text = (
-                "Analyze the following shell execution report and explain what happened. "
-                "Do not propose or return any new commands. "
-                "Do not call get_commands. "
-                "Provide only an explanation for the user.\n\n"
-                f"Execution report:\n{execution_json}"
-            )
+            prompt_prefix = _ANALYSIS_ONLY_REPORT_PREFIX
             tool_choice = "none"
+        # The report can be megabytes of output: join the encoded bytes and
+        # decode once rather than decoding and then copying into a new string.
+        prompt_text = b"".join((prompt_prefix, orjson.dumps(execution_payload))).decode()
 
         try:
-            response = self._create_response(input_data=prompt_text, tool_choice=tool_choice)
-            final_response, commands_payload = self._resolve_function_calls(response)
+            response = self._create_response(
+                input_data=prompt_text,
+                tool_choice=tool_choice,
+                on_text_delta=on_text_delta,
+            )
+            final_response, commands_payload = self._resolve_function_calls(response, on_text_delta)
 
             response_text = self._response_text(final_response)
             if response_text is None and commands_payload is not None:
@@ -412,6 +722,8 @@ class OpenAIHelper:
                 next_commands = commands_payload.get("commands") or None
 
             return response_text, next_commands
+        except _TurnCancelled:
+            return None, None
         except Exception as exc:  # pylint: disable=broad-except
             print(colored(f"Error: {exc}", "red"), file=sys.stderr)
             return None, None
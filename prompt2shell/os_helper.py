@@ -1,7 +1,21 @@
+import functools
 import os
 import platform
 
-import distro
+
+@functools.lru_cache(maxsize=1)
+def _os_description():
+    # Reads /etc/os-release or similar; the answer cannot change while running.
+    os_name = platform.system()
+    if os_name == "Linux":
+        import distro  # pylint: disable=import-outside-toplevel
+
+        os_name += f" {distro.name()}"
+    elif os_name == "Darwin":
+        os_name += f" {platform.mac_ver()[0]}"
+    elif os_name == "Windows":
+        os_name += f" {platform.release()}"
+    return os_name
 
 
 class OSHelper:
@@ -10,12 +24,5 @@ class OSHelper:
     @staticmethod
     def get_os_and_shell_info():
         """Returns the OS and shell information."""
-        os_name = platform.system()
         shell_name = os.path.basename(os.environ.get("SHELL", ""))
-        if os_name == "Linux":
-            os_name += f" {distro.name()}"
-        elif os_name == "Darwin":
-            os_name += f" {platform.mac_ver()[0]}"
-        elif os_name == "Windows":
-            os_name += f" {platform.release()}"
-        return os_name, shell_name
+        return _os_description(), shell_name
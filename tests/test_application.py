@@ -1,13 +1,26 @@
+import io
+import os
+import tempfile
+import threading
 import types
 import unittest
 from unittest import mock
 
-from prompt2shell.application import Application
+from prompt2shell.application import Application, BackgroundFileHistory, CommandSpec, _ProgressIndicator, _StreamEcho, _StyledStrings
+
+
+class _PatchableApplication(Application):
+    """Application subclass with an instance __dict__ so tests can stub methods per instance."""
+
+
+def _plain_styles():
+    with mock.patch("prompt2shell.application.colored", side_effect=lambda text, *_a, **_k: text):
+        return _StyledStrings.build()
 
 
 class ApplicationRunBannerTests(unittest.TestCase):
     def _build_app(self):
-        app = Application.__new__(Application)
+        app = _PatchableApplication.__new__(_PatchableApplication)
         app.openai_helper = types.SimpleNamespace(
             os_name="Linux",
             shell_name="bash",
@@ -16,6 +29,7 @@ class ApplicationRunBannerTests(unittest.TestCase):
         )
         app.interaction_logger = mock.Mock()
         app.session = mock.Mock()
+        app._styles = _plain_styles()
         app._process_user_input = mock.Mock(return_value=False)
         return app
 
@@ -65,9 +79,227 @@ class ApplicationRunBannerTests(unittest.TestCase):
         self.assertFalse(any("file1" in line for line in printed_lines))
         app._process_user_input.assert_called_once_with(initial_prompt)
 
+    def test_run_reports_unexpected_error_and_exits(self):
+        app = self._build_app()
+        app._process_user_input = mock.Mock(side_effect=ValueError("bad state"))
+        app.session.prompt.return_value = "list files"
+
+        with mock.patch("prompt2shell.application.colored", side_effect=lambda text, *_a, **_k: text):
+            with mock.patch("builtins.print") as print_mock:
+                app.run(initial_prompt=None)
+
+        printed_lines = [str(call.args[0]) for call in print_mock.call_args_list if call.args]
+        self.assertIn("Error of type ValueError: bad state", printed_lines)
+        self.assertEqual(printed_lines[-1], "Exiting...")
+        app._process_user_input.assert_called_once_with("list files")
+
+
+class ApplicationRuntimeCommandTests(unittest.TestCase):
+    def _build_app(self):
+        app = _PatchableApplication.__new__(_PatchableApplication)
+        app.safe_mode_enabled = True
+        app.safe_mode_strict = False
+        app.show_tokens = True
+        app.batch_analysis = False
+        app.openai_helper = mock.Mock()
+        app.interaction_logger = mock.Mock()
+        app.session = mock.Mock()
+        app._styles = _plain_styles()
+        return app
+
+    def test_handles_bare_and_slash_prefixed_toggles(self):
+        app = self._build_app()
+
+        with mock.patch("builtins.print"):
+            self.assertTrue(app._handle_runtime_command(" /Strict ON "))
+            self.assertTrue(app._handle_runtime_command("tokens off"))
+            self.assertTrue(app._handle_runtime_command("/batch on"))
+
+        self.assertTrue(app.safe_mode_strict)
+        self.assertFalse(app.show_tokens)
+        self.assertTrue(app.batch_analysis)
+
+    def test_safe_off_requires_confirmation(self):
+        app = self._build_app()
+        app.session.prompt.return_value = "n"
+
+        with mock.patch("builtins.print"):
+            self.assertTrue(app._handle_runtime_command("safe off"))
+
+        self.assertTrue(app.safe_mode_enabled)
+
+    def test_process_user_input_normalizes_once_for_quit_and_manual_mode(self):
+        app = self._build_app()
+        app.manual_command_mode = mock.Mock()
+        app.auto_command_mode = mock.Mock()
+
+        self.assertFalse(app._process_user_input(" Q "))
+        self.assertTrue(app._process_user_input("e "))
+        self.assertTrue(app._process_user_input("list files"))
+
+        app.manual_command_mode.assert_called_once_with()
+        app.auto_command_mode.assert_called_once_with("list files")
+
+    def test_ignores_regular_prompts(self):
+        app = self._build_app()
+
+        self.assertFalse(app._handle_runtime_command("safely list files"))
+
+
+class ApplicationSafeModeGuardTests(unittest.TestCase):
+    def _build_app(self):
+        app = _PatchableApplication.__new__(_PatchableApplication)
+        app.safe_mode_enabled = True
+        app.safe_mode_strict = False
+        app.command_helper = mock.Mock()
+        app.interaction_logger = mock.Mock()
+        app.session = mock.Mock()
+        app._styles = _plain_styles()
+        return app
+
+    def test_guard_rechecks_each_edited_candidate(self):
+        app = self._build_app()
+        app.command_helper.detect_destructive_command.side_effect = (
+            lambda command: "rm with recursive/force options" if command.startswith("rm") else None
+        )
+        # edit -> same command again -> edit -> safe command
+        app.session.prompt.side_effect = ["e", "rm -rf tmp", "e", "ls tmp"]
+
+        with mock.patch("builtins.print"):
+            command, skip_reason = app._guard_command_with_safe_mode("rm -rf tmp")
+
+        self.assertEqual(command, "ls tmp")
+        self.assertIsNone(skip_reason)
+        # Repeats are cheap: CommandHelper memoizes the detectors per command.
+        self.assertEqual(
+            [call.args[0] for call in app.command_helper.detect_destructive_command.call_args_list],
+            ["rm -rf tmp", "rm -rf tmp", "ls tmp"],
+        )
+
+    def test_guard_blocks_when_user_skips(self):
+        app = self._build_app()
+        app.command_helper.detect_destructive_command.return_value = "git hard reset"
+        app.session.prompt.return_value = ""
+
+        with mock.patch("builtins.print"):
+            command, skip_reason = app._guard_command_with_safe_mode("git reset --hard")
+
+        self.assertIsNone(command)
+        self.assertEqual(skip_reason, "blocked_by_safe_mode")
+
+
+class ApplicationBackgroundCallTests(unittest.TestCase):
+    def _build_app(self):
+        app = _PatchableApplication.__new__(_PatchableApplication)
+        app._styles = _plain_styles()
+        return app
+
+    def test_call_openai_returns_worker_result(self):
+        app = self._build_app()
+        func = mock.Mock(return_value=("done", None))
+
+        result = app._call_openai(func, ["out"], execution_summary=[])
+
+        self.assertEqual(result, ("done", None))
+        func.assert_called_once_with(["out"], execution_summary=[])
+
+    def test_call_openai_reraises_worker_exception(self):
+        app = self._build_app()
+
+        with self.assertRaises(RuntimeError):
+            app._call_openai(mock.Mock(side_effect=RuntimeError("boom")))
+
+    def test_progress_indicator_renders_only_on_tty(self):
+        tty_stream = io.StringIO()
+        tty_stream.isatty = lambda: True
+        indicator = _ProgressIndicator("Thinking...", stream=tty_stream)
+        indicator.tick()
+        indicator.clear()
+        self.assertIn("\rThinking... |", tty_stream.getvalue())
+        self.assertTrue(tty_stream.getvalue().endswith("\r\x1b[K"))
+
+        piped_stream = io.StringIO()
+        indicator = _ProgressIndicator("Thinking...", stream=piped_stream)
+        indicator.tick()
+        indicator.clear()
+        self.assertEqual(piped_stream.getvalue(), "")
+
+
+    def test_stream_echo_suspends_indicator_and_writes_deltas(self):
+        indicator = mock.Mock()
+        echo = _StreamEcho(indicator)
+        self.assertFalse(echo.finish())
+
+        with mock.patch("prompt2shell.application.colored", side_effect=lambda text, *_a, **_k: text):
+            with mock.patch("prompt2shell.application.sys.stdout", new_callable=io.StringIO) as stdout:
+                echo("Hello ")
+                echo("world")
+                self.assertTrue(echo.finish())
+
+        indicator.suspend.assert_called_once_with()
+        self.assertEqual(stdout.getvalue(), "Hello world\n")
+
+    def test_stream_echo_ignores_deltas_after_cancel(self):
+        echo = _StreamEcho(mock.Mock())
+        echo.cancel()
+
+        with mock.patch("prompt2shell.application.sys.stdout", new_callable=io.StringIO) as stdout:
+            echo("late text")
+
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertFalse(echo.finish())
+
+    def test_interrupt_while_waiting_cancels_the_worker_turn(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        indicator = mock.Mock()
+        indicator.tick.side_effect = KeyboardInterrupt
+        on_cancel = mock.Mock()
+
+        with mock.patch("prompt2shell.application._PROGRESS_DELAY_SECONDS", 0.01):
+            with self.assertRaises(KeyboardInterrupt):
+                Application._run_with_progress(indicator, release.wait, (), {}, on_cancel=on_cancel)
+
+        on_cancel.assert_called_once_with()
+        indicator.clear.assert_called_once_with()
+
+    def test_call_openai_interrupt_cancels_pending_helper_turn(self):
+        app = self._build_app()
+        app.openai_helper = mock.Mock()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        with mock.patch.object(_ProgressIndicator, "tick", side_effect=KeyboardInterrupt):
+            with mock.patch("prompt2shell.application._PROGRESS_DELAY_SECONDS", 0.01):
+                with self.assertRaises(KeyboardInterrupt):
+                    app._call_openai(release.wait)
+
+        app.openai_helper.cancel_pending_turn.assert_called_once_with()
+
+    def test_progress_indicator_stops_ticking_once_suspended(self):
+        tty_stream = io.StringIO()
+        tty_stream.isatty = lambda: True
+        indicator = _ProgressIndicator("Thinking...", stream=tty_stream)
+        indicator.tick()
+        indicator.suspend()
+        rendered = tty_stream.getvalue()
+        indicator.tick()
+        indicator.clear()
+        self.assertTrue(rendered.endswith("\r\x1b[K"))
+        self.assertEqual(tty_stream.getvalue(), rendered)
+
+
+class ApplicationSlotsTests(unittest.TestCase):
+    def test_application_instances_have_no_dict(self):
+        app = Application.__new__(Application)
+        self.assertFalse(hasattr(app, "__dict__"))
+        with self.assertRaises(AttributeError):
+            app.unexpected_attribute = True
+
 
 class ApplicationInitTests(unittest.TestCase):
     def test_init_prefers_tty_io_for_prompt_session(self):
+        fake_file_history = mock.Mock()
         fake_history = mock.Mock()
         fake_auto = mock.Mock()
         fake_input = mock.Mock()
@@ -81,13 +313,15 @@ class ApplicationInitTests(unittest.TestCase):
         with mock.patch("prompt2shell.application.FileHistoryPath.default", return_value="/tmp/default.hist"):
             with mock.patch("prompt2shell.application.FileHistoryPath.legacy", return_value="/tmp/legacy.hist"):
                 with mock.patch("prompt2shell.application.FileHistoryPath.exists", return_value=True):
-                    with mock.patch("prompt2shell.application.FileHistory", return_value=fake_history):
+                    with mock.patch("prompt2shell.application.BackgroundFileHistory", return_value=fake_file_history) as file_history_mock, mock.patch("prompt2shell.application.ThreadedHistory", return_value=fake_history) as threaded_history_mock:
                         with mock.patch("prompt2shell.application.AutoSuggestFromHistory", return_value=fake_auto):
                             with mock.patch("prompt2shell.application.create_input", return_value=fake_input) as create_input_mock:
                                 with mock.patch("prompt2shell.application.create_output", return_value=fake_output) as create_output_mock:
                                     with mock.patch("prompt2shell.application.PromptSession", return_value=fake_session) as prompt_session_mock:
                                         app = Application(openai_helper, command_helper, interaction_logger)
 
+        file_history_mock.assert_called_once_with("/tmp/default.hist")
+        threaded_history_mock.assert_called_once_with(fake_file_history)
         create_input_mock.assert_called_once_with(always_prefer_tty=True)
         create_output_mock.assert_called_once_with(always_prefer_tty=True)
         prompt_session_mock.assert_called_once_with(
@@ -99,9 +333,44 @@ class ApplicationInitTests(unittest.TestCase):
         self.assertIs(app.session, fake_session)
 
 
+class BackgroundFileHistoryTests(unittest.TestCase):
+    def test_store_string_is_written_by_background_thread_in_file_history_format(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "history")
+            history = BackgroundFileHistory(path)
+
+            history.store_string("ls -la")
+            history.store_string("first line\nsecond line")
+            history.flush()
+
+            reloaded = BackgroundFileHistory(path)
+            self.assertEqual(
+                list(reloaded.load_history_strings()),
+                ["first line\nsecond line", "ls -la"],
+            )
+
+
+    def test_background_history_writer_survives_unexpected_errors(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "history")
+            history = BackgroundFileHistory(path)
+            original_write = history._write_batch
+            error = UnicodeEncodeError("utf-8", "x", 0, 1, "bad")
+            with mock.patch.object(history, "_write_batch", side_effect=error) as write_mock:
+                with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                    history.store_string("broken")
+                    history.flush()
+                    write_mock.side_effect = original_write
+                    history.store_string("ls")
+                    history.flush()
+
+            self.assertIn("unable to write history", stderr.getvalue())
+            self.assertEqual(list(BackgroundFileHistory(path).load_history_strings()), ["ls"])
+
+
 class ApplicationCommandSelectionTests(unittest.TestCase):
     def _build_exec_app(self):
-        app = Application.__new__(Application)
+        app = _PatchableApplication.__new__(_PatchableApplication)
         app.openai_helper = mock.Mock()
         app.openai_helper.send_commands_outputs.return_value = (None, None)
         app.command_helper = mock.Mock()
@@ -112,6 +381,10 @@ class ApplicationCommandSelectionTests(unittest.TestCase):
         }
         app.interaction_logger = mock.Mock()
         app.session = mock.Mock()
+        app._styles = _plain_styles()
+        app.max_report_chars = 20000
+        app.stream_responses = False
+        app.batch_analysis = False
         app._guard_command_with_safe_mode = mock.Mock(side_effect=lambda command: (command, None))
         app._print_commands_batch = mock.Mock()
         app._sync_openai_session_context = mock.Mock()
@@ -128,6 +401,31 @@ class ApplicationCommandSelectionTests(unittest.TestCase):
 
         self.assertEqual(action, "2")
 
+    def test_prompt_command_action_maps_aliases_and_retries_invalid_input(self):
+        app = self._build_exec_app()
+        app.session.prompt.side_effect = ["x", "Y"]
+
+        with mock.patch("builtins.print"):
+            action = app._prompt_command_action(index=1, total=3)
+
+        self.assertEqual(action, "r")
+        self.assertEqual(app.session.prompt.call_count, 2)
+
+    def test_print_commands_batch_prints_numbered_commands_with_descriptions(self):
+        app = _PatchableApplication.__new__(_PatchableApplication)
+        app._styles = _plain_styles()
+
+        with mock.patch("prompt2shell.application.sys.stdout", new_callable=io.StringIO) as stdout_mock:
+            app._print_commands_batch(
+                [
+                    CommandSpec.from_payload({"command": " ls -la ", "description": "List files"}),
+                    CommandSpec.from_payload({"command": "pwd"}),
+                ]
+            )
+
+        printed_lines = stdout_mock.getvalue().splitlines()
+        self.assertEqual(printed_lines, ["", "Proposed commands:", "[1] ls -la", "    List files", "[2] pwd"])
+
     def test_execute_commands_runs_selected_command_by_number(self):
         app = self._build_exec_app()
         app._prompt_command_action = mock.Mock(side_effect=["2"])
@@ -176,6 +474,28 @@ class ApplicationCommandSelectionTests(unittest.TestCase):
         self.assertEqual(final_call.kwargs.get("allow_follow_up_commands"), True)
         self.assertEqual(app._print_token_usage.call_count, 3)
 
+    def test_execute_commands_batch_analysis_sends_one_report(self):
+        app = self._build_exec_app()
+        app.batch_analysis = True
+        app._prompt_command_action = mock.Mock(side_effect=["r", "r"])
+        app.command_helper.run_shell_command.side_effect = [
+            {"returncode": 0, "timed_out": False, "interrupted": False, "stdout": "one"},
+            {"returncode": 0, "timed_out": False, "interrupted": False, "stdout": "two"},
+        ]
+
+        commands = [
+            {"command": "echo one", "description": "first"},
+            {"command": "echo two", "description": "second"},
+        ]
+        with mock.patch("builtins.print"):
+            app.execute_commands(commands)
+
+        self.assertEqual(app._prompt_command_action.call_count, 2)
+        app.openai_helper.send_commands_outputs.assert_called_once()
+        call = app.openai_helper.send_commands_outputs.call_args
+        self.assertEqual(len(call.args[0]), 2)
+        self.assertEqual(call.kwargs.get("allow_follow_up_commands"), True)
+
     def test_execute_commands_run_all_waits_for_single_final_ai_call(self):
         app = self._build_exec_app()
         app._prompt_command_action = mock.Mock(side_effect=["a"])
@@ -200,6 +520,32 @@ class ApplicationCommandSelectionTests(unittest.TestCase):
         self.assertEqual(call.kwargs.get("allow_follow_up_commands"), True)
         self.assertEqual(app._print_token_usage.call_count, 1)
 
+    def test_execute_commands_caps_output_sent_to_assistant(self):
+        app = self._build_exec_app()
+        app.max_report_chars = 5
+        app.command_helper.truncate_text.side_effect = lambda text, limit: text[:limit] + "...[truncated]"
+        app._prompt_command_action = mock.Mock(side_effect=["a"])
+        app.command_helper.run_shell_command.return_value = {
+            "command": "cat big.log",
+            "stdout": "0123456789",
+            "stderr": "",
+            "returncode": 0,
+            "timed_out": False,
+            "interrupted": False,
+        }
+
+        with mock.patch("builtins.print"):
+            app.execute_commands([{"command": "cat big.log", "description": ""}])
+
+        sent_outputs = app.openai_helper.send_commands_outputs.call_args.args[0]
+        self.assertEqual(sent_outputs[0]["stdout"], "01234...[truncated]")
+        logged_events = [call.args[0] for call in app.interaction_logger.log_event.call_args_list]
+        self.assertIn("output_truncated", logged_events)
+        executed_log = next(
+            call.args[1] for call in app.interaction_logger.log_event.call_args_list if call.args[0] == "command_executed"
+        )
+        self.assertEqual(executed_log["stdout"], "0123456789")
+
     def test_execute_commands_runs_follow_up_batch_returned_by_ai(self):
         app = self._build_exec_app()
         app._prompt_command_action = mock.Mock(side_effect=["a", "a"])
@@ -1,14 +1,23 @@
+import contextlib
 import io
 import os
 import re
 import shlex
 import signal
+import subprocess
 import sys
 import time
 import unittest
 from unittest import mock
 
-from prompt2shell.command_helper import CommandHelper
+from prompt2shell.command_helper import CommandHelper, _StreamCapture
+
+
+def _closed_pipe_reader(data=b""):
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, data)
+    os.close(write_fd)
+    return open(read_fd, "rb", buffering=0)
 
 
 class CommandRuntimeTests(unittest.TestCase):
@@ -51,11 +60,120 @@ class CommandRuntimeTests(unittest.TestCase):
 
         self.assertFalse(child_alive, "child process should be terminated after timeout")
 
+    @unittest.skipUnless(os.name == "posix", "process groups are POSIX-only")
+    def test_timeout_sends_sigterm_before_sigkill(self):
+        command = "trap 'echo cleanup; exit 143' TERM; while :; do sleep 0.1; done"
+        with mock.patch.dict(os.environ, {"PROMPT2SHELL_COMMAND_TIMEOUT": "1"}):
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = CommandHelper.run_shell_command(command)
+
+        self.assertTrue(result["timed_out"])
+        self.assertIn("cleanup", result["stdout"])
+
+    def test_wait_process_returns_exit_code_or_raises_timeout(self):
+        process = subprocess.Popen([sys.executable, "-c", "raise SystemExit(3)"])
+        self.assertEqual(CommandHelper._wait_process(process, 10), 3)
+
+        process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+        try:
+            with self.assertRaises(subprocess.TimeoutExpired):
+                CommandHelper._wait_process(process, 0.1)
+        finally:
+            process.kill()
+            process.wait()
+
+    @unittest.skipUnless(os.name == "posix", "process groups are POSIX-only")
+    def test_second_interrupt_during_grace_period_still_kills_the_group(self):
+        process = mock.Mock(pid=4242)
+        process.poll.return_value = None
+
+        with mock.patch("prompt2shell.command_helper.os.killpg") as killpg:
+            with mock.patch.object(CommandHelper, "_wait_process", side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    CommandHelper._terminate_process_tree(process)
+
+        self.assertEqual(killpg.call_args_list, [mock.call(4242, signal.SIGTERM), mock.call(4242, signal.SIGKILL)])
+
+    def test_captures_both_streams_and_echoes_partial_last_line(self):
+        command = "printf 'first\\nsecond'; printf 'oops\\n' 1>&2"
+        echoed = io.StringIO()
+        with contextlib.redirect_stdout(echoed):
+            result = CommandHelper.run_shell_command(command)
+
+        self.assertEqual(result["returncode"], 0)
+        self.assertEqual(result["stdout"], "first\nsecond")
+        self.assertEqual(result["stderr"], "oops\n")
+        for fragment in ("first\n", "second", "oops"):
+            self.assertIn(fragment, echoed.getvalue())
+
+    def test_capture_keeps_head_and_tail_of_large_output(self):
+        command = "printf 'start\\n'; seq 1 20000; printf 'end\\n'"
+        with mock.patch("prompt2shell.command_helper._CAPTURE_HEAD_BYTES", 64), mock.patch(
+            "prompt2shell.command_helper._CAPTURE_TAIL_BYTES", 64
+        ):
+            with contextlib.redirect_stdout(io.StringIO()) as echoed:
+                result = CommandHelper.run_shell_command(command)
+
+        stdout = result["stdout"]
+        self.assertTrue(stdout.startswith("start\n1\n"))
+        self.assertTrue(stdout.endswith("20000\nend\n"))
+        self.assertRegex(stdout, r"\.\.\.\[truncated [0-9]+ bytes\]\.\.\.")
+        self.assertLess(len(stdout), 200)
+        self.assertIn("\n12345\n", echoed.getvalue())
+
+    def test_capture_windows_never_keep_part_of_a_secret_cut_at_the_boundary(self):
+        capture = _StreamCapture(_closed_pipe_reader())
+        output = (
+            b"ok\nkey sk-ABCDEFGHIJKLMNOPQRST\n"
+            + b"filler line\n" * 8
+            + b"tail sk-ZYXWVUTSRQPONMLKJIHG end\n"
+        )
+        with mock.patch("prompt2shell.command_helper._CAPTURE_HEAD_BYTES", 16), mock.patch(
+            "prompt2shell.command_helper._CAPTURE_TAIL_BYTES", 24
+        ):
+            with contextlib.redirect_stdout(io.StringIO()):
+                capture.feed(output)
+                capture.finish()
+            text = capture.redacted_text()
+
+        self.assertTrue(text.startswith("ok\n"))
+        self.assertIn(f"...[truncated {len(output) - 3} bytes]...", text)
+        for fragment in ("ABCDEF", "LKJIHG", "sk-"):
+            self.assertNotIn(fragment, text)
+
+    def test_capture_echoes_output_without_newlines_once_pending_is_capped(self):
+        capture = _StreamCapture(_closed_pipe_reader())
+        echoed = io.StringIO()
+        with mock.patch("prompt2shell.command_helper._ECHO_PENDING_MAX_BYTES", 8):
+            with contextlib.redirect_stdout(echoed):
+                capture.feed(b"abc")
+                self.assertEqual(echoed.getvalue(), "")
+                capture.feed("defż".encode("utf-8")[:-1])
+                capture.feed("ż".encode("utf-8")[-1:] + b"gh\r")
+                capture.feed(b"\nrest")
+                capture.finish()
+
+        self.assertEqual(echoed.getvalue(), "abcdefżgh\nrest")
+        self.assertEqual(capture.redacted_text(), "abcdefżgh\nrest")
+
+    def test_colored_capture_closes_only_the_final_partial_line(self):
+        capture = _StreamCapture(_closed_pipe_reader(), "red")
+        echoed = io.StringIO()
+        with mock.patch("prompt2shell.command_helper.colored", side_effect=lambda text, color: f"<{text}>"):
+            with mock.patch("prompt2shell.command_helper._ECHO_PENDING_MAX_BYTES", 4):
+                with contextlib.redirect_stdout(echoed):
+                    capture.feed(b"one\ntw")
+                    capture.feed(b"oooo")
+                    capture.feed(b"\nend")
+                    capture.finish()
+
+        self.assertEqual(echoed.getvalue(), "<one>\n<twoooo>\n<end>\n")
+
     def test_keyboard_interrupt_sets_interrupted_flag(self):
         class FakeProcess:
             def __init__(self):
-                self.stdout = io.StringIO("")
-                self.stderr = io.StringIO("")
+                self.stdout = _closed_pipe_reader()
+                self.stderr = _closed_pipe_reader()
                 self.pid = 999999
                 self._wait_calls = 0
 
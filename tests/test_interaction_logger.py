@@ -1,7 +1,9 @@
+import io
 import json
 import os
 import stat
 import tempfile
+import threading
 import unittest
 from unittest import mock
 
@@ -24,6 +26,7 @@ class InteractionLoggerTests(unittest.TestCase):
             with mock.patch.dict(os.environ, {"PROMPT2SHELL_LOG_ENABLED": "1"}, clear=True):
                 logger = InteractionLogger(log_file=log_path)
                 logger.log("user", "Authorization: Bearer secret-token")
+                logger.flush()
 
             self.assertTrue(os.path.exists(log_path))
             permissions = stat.S_IMODE(os.stat(log_path).st_mode)
@@ -35,6 +38,164 @@ class InteractionLoggerTests(unittest.TestCase):
             self.assertIn("<REDACTED>", entry["text"])
             self.assertNotIn("secret-token", entry["text"])
 
+    def test_message_text_is_redacted_on_the_writer_thread(self):
+        redacting_threads = []
+
+        def record_thread(text):
+            redacting_threads.append(threading.current_thread().name)
+            return text
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            logger = InteractionLogger(log_file=os.path.join(tmp_dir, "threaded.log"), enabled=True)
+            with mock.patch(
+                "prompt2shell.interaction_logger.CommandHelper.redact_sensitive_text_cached",
+                side_effect=record_thread,
+            ):
+                logger.log("user", "token=abc")
+                logger.flush()
+
+        self.assertEqual(redacting_threads, ["prompt2shell-log"])
+
+    def test_events_written_in_background_and_repeats_are_coalesced(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, "events.log")
+            logger = InteractionLogger(log_file=log_path, enabled=True)
+            logger.log_event("command_skipped", {"command": "ls"})
+            logger.log_event("command_skipped", {"command": "ls"})
+            logger.log_event("command_skipped", {"command": "pwd"})
+            logger.flush()
+
+            with open(log_path, "r", encoding="utf-8") as handle:
+                entries = [json.loads(line) for line in handle]
+
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]["data"], {"command": "ls"})
+        self.assertEqual(entries[0]["repeat"], 2)
+        self.assertEqual(entries[1]["data"], {"command": "pwd"})
+        self.assertNotIn("repeat", entries[1])
+
+    def test_message_log_flushes_pending_events_in_order(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, "ordered.log")
+            logger = InteractionLogger(log_file=log_path, enabled=True)
+            logger.log_event("commands_batch", [])
+            logger.log("assistant", "done")
+            logger.flush()
+
+            with open(log_path, "r", encoding="utf-8") as handle:
+                entries = [json.loads(line) for line in handle]
+
+        self.assertEqual([entry.get("event", entry.get("role")) for entry in entries], ["commands_batch", "assistant"])
+
+    def test_callable_event_payload_is_built_only_when_enabled(self):
+        payload_factory = mock.Mock(return_value={"response_id": "resp_1"})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, "lazy.log")
+            InteractionLogger(log_file=log_path, enabled=False).log_event("api_response", payload_factory)
+            payload_factory.assert_not_called()
+
+            logger = InteractionLogger(log_file=log_path, enabled=True)
+            logger.log_event("api_response", payload_factory)
+            logger.flush()
+
+            with open(log_path, "r", encoding="utf-8") as handle:
+                entry = json.loads(handle.readline())
+
+        payload_factory.assert_called_once_with()
+        self.assertEqual(entry["data"], {"response_id": "resp_1"})
+
+    def test_entries_keep_unicode_and_stringify_non_string_keys(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, "unicode.log")
+            logger = InteractionLogger(log_file=log_path, enabled=True)
+            logger.log_event("output_truncated", {"original_chars": {1: 10}, "command": "cat zażółć.txt"})
+            logger.flush()
+
+            with open(log_path, "r", encoding="utf-8") as handle:
+                line = handle.readline()
+
+        self.assertIn("zażółć", line)
+        self.assertEqual(json.loads(line)["data"]["original_chars"], {"1": 10})
+
+    def test_log_file_descriptor_is_reused_until_close(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, "reused.log")
+            logger = InteractionLogger(log_file=log_path, enabled=True)
+            with mock.patch("prompt2shell.interaction_logger.os.open", wraps=os.open) as open_mock:
+                logger.log("user", "first")
+                logger.log("assistant", "second")
+                logger.flush()
+            logger.close()
+            logger.log("user", "third")
+            logger.close()
+
+            with open(log_path, "r", encoding="utf-8") as handle:
+                texts = [json.loads(line)["text"] for line in handle]
+
+        open_mock.assert_called_once()
+        self.assertEqual(texts, ["first", "second", "third"])
+
+    def test_event_payload_mutated_after_logging_is_written_as_logged(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, "snapshot.log")
+            logger = InteractionLogger(log_file=log_path, enabled=True)
+            payload = {"cmd": "ls"}
+            with logger._lock:
+                logger.log_event("command_executed", payload)
+                payload["cmd"] = "rm -rf / password=hunter2"
+            logger.flush()
+
+            with open(log_path, "r", encoding="utf-8") as handle:
+                entry = json.loads(handle.readline())
+
+        self.assertEqual(entry["data"], {"cmd": "ls"})
+
+    def test_writer_survives_unexpected_errors_and_keeps_draining(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, "resilient.log")
+            logger = InteractionLogger(log_file=log_path, enabled=True)
+            with mock.patch.object(logger, "_open_log_fd", side_effect=RuntimeError("boom")):
+                with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                    logger.log("user", "first")
+                    logger.flush()
+            logger.log("user", "second")
+            logger.close()
+
+            with open(log_path, "r", encoding="utf-8") as handle:
+                texts = [json.loads(line)["text"] for line in handle]
+
+        self.assertIn("unable to write log", stderr.getvalue())
+        self.assertEqual(texts, ["second"])
+
+    def test_unserializable_entry_does_not_drop_the_rest_of_its_batch(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, "mixed.log")
+            logger = InteractionLogger(log_file=log_path, enabled=True)
+            with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                with logger._lock:
+                    logger.log("user", "before")
+                    logger.log_event("bad_payload", {"value": object()})
+                    logger.log("assistant", "after")
+                logger.flush()
+
+            with open(log_path, "r", encoding="utf-8") as handle:
+                entries = [json.loads(line) for line in handle]
+
+        self.assertEqual([entry.get("text") for entry in entries], ["before", None, "after"])
+        self.assertEqual(entries[1]["event"], "log_entry_dropped")
+        self.assertIn("TypeError", entries[1]["data"]["error"])
+        self.assertIn("unable to log entry", stderr.getvalue())
+
+    def test_sanitize_snapshots_clean_payloads_and_redacts_nested_secrets(self):
+        clean = {"commands": [{"command": "ls -la", "description": "List files"}]}
+        sanitized_clean = InteractionLogger._sanitize_for_log(clean)
+        self.assertEqual(sanitized_clean, clean)
+        self.assertIsNot(sanitized_clean, clean)
+
+        dirty = {"outputs": [{"stdout": "export OPENAI_API_KEY=sk-abcdefghijklmnop"}]}
+        sanitized = InteractionLogger._sanitize_for_log(dirty)
+        self.assertEqual(sanitized["outputs"][0]["stdout"], "export OPENAI_API_KEY=<REDACTED>")
+
 
 if __name__ == "__main__":
     unittest.main()
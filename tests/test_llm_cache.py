@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from prompt2shell.llm_cache import FileBackend, LLMCache, MemoryBackend, prompt_signature, prompt_similarity
+
+
+class LLMCacheTests(unittest.TestCase):
+    def test_cache_key_ignores_argument_order_and_tracks_every_part(self):
+        key = LLMCache.cache_key(model="gpt-test", prompt="list files")
+        self.assertEqual(key, LLMCache.cache_key(prompt="list files", model="gpt-test"))
+        self.assertNotEqual(key, LLMCache.cache_key(model="gpt-test", prompt="list files", shell_name="zsh"))
+
+    def test_memory_backend_evicts_least_recently_used_entry(self):
+        cache = LLMCache(MemoryBackend(max_entries=2))
+        cache.set("a", {"commands": []})
+        cache.set("b", {"commands": []})
+        cache.get("a")
+        cache.set("c", {"commands": []})
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+
+    def test_get_returns_private_copy(self):
+        cache = LLMCache(MemoryBackend())
+        cache.set("key", {"commands": [{"command": "ls"}]})
+        cache.get("key")["commands"].clear()
+
+        self.assertEqual(cache.get("key"), {"commands": [{"command": "ls"}]})
+
+    def test_file_backend_persists_entries_and_drops_expired_ones(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = os.path.join(tmp_dir, "responses")
+            LLMCache(FileBackend(cache_dir), ttl_seconds=60).set("key", {"response": "ok"})
+
+            reopened = LLMCache(FileBackend(cache_dir), ttl_seconds=60)
+            self.assertEqual(reopened.get("key"), {"response": "ok"})
+
+            with mock.patch("prompt2shell.llm_cache.time.time", return_value=10**12):
+                self.assertIsNone(reopened.get("key"))
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, "key.json")))
+
+    def test_prompt_similarity_requires_identical_critical_tokens(self):
+        reference = prompt_signature("list files in /tmp")
+
+        self.assertEqual(prompt_similarity(reference, prompt_signature("Show the files under /tmp")), 1.0)
+        self.assertEqual(prompt_similarity(reference, prompt_signature("list files in /var")), 0.0)
+        self.assertEqual(prompt_similarity(reference, prompt_signature("list files in /tmp -a")), 0.0)
+        self.assertLess(prompt_similarity(reference, prompt_signature("delete files in /tmp")), 0.5)
+
+    def test_prompt_similarity_keeps_direction_and_argument_order(self):
+        reference = prompt_signature("copy report.txt from /srv to /backup")
+
+        self.assertEqual(prompt_similarity(reference, prompt_signature("copy report.txt from /backup to /srv")), 0.0)
+        self.assertEqual(prompt_similarity(reference, prompt_signature("copy report.txt to /srv from /backup")), 0.0)
+        self.assertEqual(prompt_similarity(reference, prompt_signature("please copy report.txt from /srv to /backup")), 1.0)
+        self.assertEqual(
+            prompt_similarity(prompt_signature("copy report from backup to srv"), prompt_signature("copy report from srv to backup")),
+            0.0,
+        )
+        self.assertEqual(prompt_similarity(prompt_signature("cp a.txt b.txt"), prompt_signature("cp b.txt a.txt")), 0.0)
+
+    def test_prompt_similarity_rejects_requests_with_a_different_scope(self):
+        pairs = (
+            ("delete all logs", "delete some logs"),
+            ("kill my processes", "kill processes"),
+            ("remove all containers", "remove this container"),
+            ("stop every service", "stop the service"),
+            ("show files in my home", "show files in our home"),
+        )
+        for left, right in pairs:
+            with self.subTest(left=left, right=right):
+                self.assertEqual(prompt_similarity(prompt_signature(left), prompt_signature(right)), 0.0)
+
+    def test_prompt_index_stores_redacted_prompts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = LLMCache(FileBackend(tmp_dir), similarity_threshold=0.92)
+            cache.set("answer", {"commands": [{"command": "curl"}]})
+            cache.remember_prompt("index", "call the api with token=abc123secret", "answer")
+
+            with open(os.path.join(tmp_dir, "index.json"), "r", encoding="utf-8") as handle:
+                stored = handle.read()
+
+            self.assertNotIn("abc123secret", stored)
+            self.assertEqual(
+                cache.find_similar("index", "call the api with token=abc123secret"), {"commands": [{"command": "curl"}]}
+            )
+
+    def test_find_similar_returns_answer_for_near_duplicate_prompt(self):
+        cache = LLMCache(MemoryBackend(), similarity_threshold=0.92)
+        cache.set("answer", {"commands": [{"command": "ls /tmp"}]})
+        cache.remember_prompt("index", "list files in /tmp", "answer")
+
+        self.assertEqual(cache.find_similar("index", "show the files under /tmp"), {"commands": [{"command": "ls /tmp"}]})
+        self.assertIsNone(cache.find_similar("index", "show the files under /home"))
+
+        cache.similarity_threshold = None
+        self.assertIsNone(cache.find_similar("index", "show the files under /tmp"))
+
+    def test_from_env_is_off_by_default_and_selects_backend(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(LLMCache.from_env())
+        with mock.patch.dict(os.environ, {"PROMPT2SHELL_CACHE": "memory"}, clear=True):
+            memory_cache = LLMCache.from_env()
+        self.assertIsInstance(memory_cache.backend, MemoryBackend)
+        self.assertEqual(memory_cache.similarity_threshold, 0.92)
+        with mock.patch.dict(os.environ, {"PROMPT2SHELL_CACHE": "memory", "PROMPT2SHELL_CACHE_SIMILARITY": "0"}, clear=True):
+            self.assertIsNone(LLMCache.from_env().similarity_threshold)
+        with mock.patch.dict(
+            os.environ,
+            {"PROMPT2SHELL_CACHE": "1", "PROMPT2SHELL_CACHE_DIR": "/tmp/p2s-cache"},
+            clear=True,
+        ):
+            cache = LLMCache.from_env()
+        self.assertIsInstance(cache.backend, FileBackend)
+        self.assertEqual(cache.backend.directory, "/tmp/p2s-cache")
+
+
+if __name__ == "__main__":
+    unittest.main()
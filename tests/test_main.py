@@ -1,3 +1,4 @@
+import io
 import unittest
 from unittest import mock
 
@@ -9,7 +10,7 @@ class MainEntrypointTests(unittest.TestCase):
     def _stdin_patch(is_tty=True, text=""):
         fake_stdin = mock.Mock()
         fake_stdin.isatty.return_value = is_tty
-        fake_stdin.read.return_value = text
+        fake_stdin.buffer = io.BytesIO(text.encode("utf-8"))
         return mock.patch("prompt2shell.main.sys.stdin", fake_stdin)
 
     def test_main_runs_without_initial_prompt_when_no_argv(self):
@@ -99,6 +100,31 @@ class MainEntrypointTests(unittest.TestCase):
             has_piped_input=True,
         )
 
+    def test_main_closes_openai_helper_even_when_run_raises(self):
+        fake_app = mock.Mock()
+        fake_app.run.side_effect = KeyboardInterrupt
+
+        with self._stdin_patch(is_tty=True):
+            with mock.patch("prompt2shell.main.build_application", return_value=fake_app):
+                with self.assertRaises(KeyboardInterrupt):
+                    main_module.main([])
+
+        fake_app.openai_helper.close.assert_called_once_with()
+
+    def test_read_piped_input_truncates_at_line_boundary_when_over_cap(self):
+        with self._stdin_patch(is_tty=False, text="alpha\nbravo\ncharlie\n"):
+            with mock.patch.dict("os.environ", {"PROMPT2SHELL_PIPE_MAX_BYTES": "14"}, clear=False):
+                piped_text = main_module.read_piped_input()
+
+        self.assertEqual(piped_text, "alpha\nbravo\n...[piped input truncated at 14 bytes]")
+
+    def test_read_piped_input_keeps_input_that_fits_the_cap_exactly(self):
+        with self._stdin_patch(is_tty=False, text="alpha\nbravo"):
+            with mock.patch.dict("os.environ", {"PROMPT2SHELL_PIPE_MAX_BYTES": "11"}, clear=False):
+                piped_text = main_module.read_piped_input()
+
+        self.assertEqual(piped_text, "alpha\nbravo")
+
     def test_infer_piped_source_description_detects_ls_long_listing(self):
         piped_text = (
             "total 8\n"
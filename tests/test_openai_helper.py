@@ -1,10 +1,30 @@
+import io
 import json
 import os
 import types
 import unittest
 from unittest import mock
 
-from prompt2shell.openai_helper import OpenAIHelper
+import httpx
+
+from prompt2shell.openai_helper import OpenAIHelper, UsageSummary
+
+
+class _FakeStream:
+    """Stands in for the SDK Stream: iterable, and closed through its context manager."""
+
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.closed = True
 
 
 class OpenAIHelperTests(unittest.TestCase):
@@ -57,10 +77,36 @@ class OpenAIHelperTests(unittest.TestCase):
         self.assertIsNotNone(payload)
         self.assertEqual(payload["commands"][0]["command"], "ls -la")
         self.assertEqual(payload["response"], "Here is the command.")
-        self.assertEqual(helper.last_response_id, "resp_2")
-
+        # The forced get_commands call is acknowledged with the next request, not a round trip of its own.
+        self.assertEqual(len(fake_api.calls), 1)
+        self.assertEqual(helper.last_response_id, "resp_1")
         self.assertEqual(fake_api.calls[0]["tool_choice"], {"type": "function", "name": "get_commands"})
-        self.assertEqual(fake_api.calls[1]["tool_choice"], "none")
+
+        self.assertEqual(
+            fake_api.calls[0]["input"],
+            [
+                {"role": "developer", "content": helper.environment_context},
+                {"role": "user", "content": "show files"},
+            ],
+        )
+        self.assertIn(helper.shell_name or "the default", helper.environment_context)
+        self.assertNotIn(helper.os_name, json.dumps(fake_api.calls[0]["tools"]))
+
+        response_text, _ = helper.send_commands_outputs(
+            outputs=[{"returncode": 0, "stdout": "a.txt"}],
+            execution_summary=[{"command": "ls -la", "status": "executed"}],
+            allow_follow_up_commands=False,
+        )
+
+        self.assertEqual(response_text, "Done")
+        self.assertEqual(fake_api.calls[1]["previous_response_id"], "resp_1")
+        pending_output, analysis_message = fake_api.calls[1]["input"]
+        self.assertEqual(pending_output["type"], "function_call_output")
+        self.assertEqual(pending_output["call_id"], "call_1")
+        self.assertEqual(analysis_message["role"], "user")
+        self.assertIn("Execution report:", analysis_message["content"])
+        self.assertEqual(helper.last_response_id, "resp_2")
+        self.assertIsNone(helper._pending_tool_outputs)
 
     def test_instructions_include_session_mode_context(self):
         fake_responses = [
@@ -205,7 +251,366 @@ class OpenAIHelperTests(unittest.TestCase):
         self.assertEqual(response_text, "The command listed files successfully.")
         self.assertIsNone(next_commands)
         self.assertEqual(fake_api.calls[0]["tool_choice"], "none")
-        self.assertIn("Do not propose or return any new commands.", fake_api.calls[0]["input"])
+        environment_message, user_message = fake_api.calls[0]["input"]
+        self.assertEqual(environment_message["role"], "developer")
+        self.assertIn("Do not propose or return any new commands.", user_message["content"])
+
+    def test_send_commands_outputs_streams_text_deltas_to_handler(self):
+        final_response = types.SimpleNamespace(
+            id="resp_1",
+            usage=types.SimpleNamespace(input_tokens=5, output_tokens=7, total_tokens=12),
+            output=[],
+            output_text="Listed two files.",
+        )
+        events = [
+            types.SimpleNamespace(type="response.created"),
+            types.SimpleNamespace(type="response.output_text.delta", delta="Listed "),
+            types.SimpleNamespace(type="response.output_text.delta", delta="two files."),
+            types.SimpleNamespace(type="response.completed", response=final_response),
+        ]
+
+        class FakeResponsesAPI:
+            def __init__(self):
+                self.calls = []
+
+            def create(self, **kwargs):
+                self.calls.append(kwargs)
+                self.stream = _FakeStream(events)
+                return self.stream
+
+        fake_api = FakeResponsesAPI()
+        fake_client = types.SimpleNamespace(responses=fake_api)
+        deltas = []
+
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}, clear=False):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=fake_client):
+                helper = OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+                response_text, next_commands = helper.send_commands_outputs(
+                    outputs=[{"returncode": 0, "stdout": "file1\nfile2"}],
+                    execution_summary=[{"command": "ls", "status": "executed"}],
+                    allow_follow_up_commands=False,
+                    on_text_delta=deltas.append,
+                )
+
+        self.assertEqual(deltas, ["Listed ", "two files."])
+        self.assertEqual(response_text, "Listed two files.")
+        self.assertIsNone(next_commands)
+        self.assertTrue(fake_api.calls[0]["stream"])
+        self.assertTrue(fake_api.stream.closed)
+        self.assertEqual(helper.last_response_id, "resp_1")
+        self.assertEqual(helper.get_last_usage_summary()["total_tokens"], 12)
+
+    def test_cancelled_turn_stops_streaming_and_drops_late_response(self):
+        final_response = types.SimpleNamespace(id="resp_late", usage=None, output=[], output_text="Too late")
+        events = [
+            types.SimpleNamespace(type="response.output_text.delta", delta="First "),
+            types.SimpleNamespace(type="response.output_text.delta", delta="second"),
+            types.SimpleNamespace(type="response.completed", response=final_response),
+        ]
+        streams = []
+
+        def create(**_kwargs):
+            streams.append(_FakeStream(events))
+            return streams[-1]
+
+        fake_client = types.SimpleNamespace(responses=types.SimpleNamespace(create=create))
+
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}, clear=False):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=fake_client):
+                helper = OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+
+        deltas = []
+
+        def on_delta(delta):
+            deltas.append(delta)
+            helper.cancel_pending_turn()
+
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            result = helper.send_commands_outputs(outputs=[], on_text_delta=on_delta)
+
+        self.assertEqual(result, (None, None))
+        self.assertEqual(deltas, ["First "])
+        self.assertTrue(streams[0].closed)
+        self.assertIsNone(helper.last_response_id)
+        self.assertEqual(helper.get_session_usage_summary()["api_calls"], 0)
+        self.assertEqual(stderr.getvalue(), "")
+
+        # The next turn starts under the new generation and works normally.
+        events[:] = [types.SimpleNamespace(type="response.completed", response=final_response)]
+        self.assertEqual(helper.send_commands_outputs(outputs=[], on_text_delta=deltas.append)[0], "Too late")
+        self.assertEqual(helper.last_response_id, "resp_late")
+
+    def test_cancel_during_tool_follow_up_keeps_outputs_for_next_turn(self):
+        call_response = types.SimpleNamespace(
+            id="resp_calls",
+            usage=None,
+            output=[
+                types.SimpleNamespace(
+                    type="function_call",
+                    name="get_commands",
+                    arguments=json.dumps({"commands": [{"command": "ls", "description": "List"}], "response": "OK"}),
+                    call_id="call_1",
+                    id="item_1",
+                )
+            ],
+            output_text=None,
+        )
+        abandoned = types.SimpleNamespace(id="resp_abandoned", usage=None, output=[], output_text="Never shown")
+        next_response = types.SimpleNamespace(id="resp_next", usage=None, output=[], output_text="ok")
+        queue = [
+            _FakeStream([types.SimpleNamespace(type="response.completed", response=call_response)]),
+            _FakeStream(
+                [
+                    types.SimpleNamespace(type="response.output_text.delta", delta="Partial"),
+                    types.SimpleNamespace(type="response.completed", response=abandoned),
+                ]
+            ),
+            next_response,
+        ]
+        calls = []
+
+        def create(**kwargs):
+            calls.append(kwargs)
+            return queue.pop(0)
+
+        fake_client = types.SimpleNamespace(responses=types.SimpleNamespace(create=create))
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}, clear=False):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=fake_client):
+                helper = OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+
+        result = helper.send_commands_outputs(outputs=[], on_text_delta=lambda _delta: helper.cancel_pending_turn())
+
+        self.assertEqual(result, (None, None))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(helper.last_response_id, "resp_calls")
+
+        helper.get_commands("show files")
+        follow_up = calls[2]
+        self.assertEqual(follow_up["previous_response_id"], "resp_calls")
+        self.assertEqual(follow_up["input"][0]["type"], "function_call_output")
+        self.assertEqual(follow_up["input"][0]["call_id"], "call_1")
+        self.assertEqual(follow_up["input"][1], {"role": "user", "content": "show files"})
+
+    def test_get_commands_reuses_cached_payload_for_fresh_conversation(self):
+        def make_responses():
+            return [
+                types.SimpleNamespace(
+                    id="resp_1",
+                    usage=types.SimpleNamespace(input_tokens=10, output_tokens=20, total_tokens=30),
+                    output=[
+                        types.SimpleNamespace(
+                            type="function_call",
+                            name="get_commands",
+                            arguments=json.dumps(
+                                {"commands": [{"command": "df -h", "description": "Disk usage"}], "response": "OK"}
+                            ),
+                            call_id="call_1",
+                            id="item_1",
+                        )
+                    ],
+                    output_text=None,
+                ),
+                types.SimpleNamespace(id="resp_2", usage=None, output=[], output_text="Done"),
+            ]
+
+        class FakeResponsesAPI:
+            def __init__(self):
+                self.queue = make_responses() + make_responses()
+                self.calls = []
+
+            def create(self, **kwargs):
+                self.calls.append(kwargs)
+                return self.queue.pop(0)
+
+        fake_api = FakeResponsesAPI()
+        fake_client = types.SimpleNamespace(responses=fake_api)
+
+        with mock.patch.dict(
+            os.environ,
+            {"OPENAI_API_KEY": "test-key", "PROMPT2SHELL_CACHE": "memory"},
+            clear=False,
+        ):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=fake_client):
+                first_helper = OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+                second_helper = OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+
+        second_helper.response_cache = first_helper.response_cache
+        first_payload = first_helper.get_commands("show disk usage")
+        cached_payload = second_helper.get_commands("show disk usage")
+
+        self.assertEqual(len(fake_api.calls), 1)
+        self.assertEqual(cached_payload, first_payload)
+        self.assertEqual(second_helper.get_last_usage_summary()["api_calls"], 0)
+
+        # A chained follow-up depends on server-side state and is never served from cache.
+        first_helper.get_commands("show disk usage")
+        self.assertEqual(len(fake_api.calls), 2)
+        self.assertEqual(fake_api.calls[1]["previous_response_id"], "resp_1")
+
+        # The cache hit never reached the server, so the analysis request that
+        # starts the chain replays the question and the cached commands first.
+        fake_api.queue = [types.SimpleNamespace(id="resp_3", usage=None, output=[], output_text="Looks fine")]
+        second_helper.send_commands_outputs([{"command": "df -h", "stdout": "ok"}])
+        follow_up = fake_api.calls[2]
+        self.assertNotIn("previous_response_id", follow_up)
+        replayed = follow_up["input"]
+        self.assertEqual(replayed[0]["role"], "developer")
+        self.assertEqual(replayed[1], {"role": "user", "content": "show disk usage"})
+        self.assertEqual(replayed[2]["type"], "function_call")
+        self.assertEqual(json.loads(replayed[2]["arguments"]), cached_payload)
+        self.assertEqual(replayed[3]["type"], "function_call_output")
+        self.assertEqual(replayed[3]["call_id"], replayed[2]["call_id"])
+        self.assertEqual(replayed[4]["role"], "user")
+        self.assertIn('"stdout":"ok"', replayed[4]["content"])
+        self.assertEqual(second_helper._cached_turns, [])
+
+    def test_get_commands_treats_malformed_cached_payload_as_miss(self):
+        calls = []
+
+        def create(**kwargs):
+            calls.append(kwargs)
+            return types.SimpleNamespace(
+                id="resp_1",
+                usage=None,
+                output=[
+                    types.SimpleNamespace(
+                        type="function_call",
+                        name="get_commands",
+                        arguments=json.dumps({"commands": [{"command": "df -h"}], "response": "OK"}),
+                        call_id="call_1",
+                        id="item_1",
+                    )
+                ],
+                output_text=None,
+            )
+
+        fake_client = types.SimpleNamespace(responses=types.SimpleNamespace(create=create))
+        with mock.patch.dict(
+            os.environ,
+            {"OPENAI_API_KEY": "test-key", "PROMPT2SHELL_CACHE": "memory"},
+            clear=False,
+        ):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=fake_client):
+                helper = OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+
+        with mock.patch.object(helper.response_cache, "get", return_value={"commands": "rm -rf ~"}):
+            payload = helper.get_commands("show disk usage")
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(payload["commands"], [{"command": "df -h", "description": ""}])
+        self.assertEqual(helper._cached_turns, [])
+
+    def test_instructions_are_rebuilt_only_when_session_context_changes(self):
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}, clear=False):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=types.SimpleNamespace()):
+                helper = OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+
+        with mock.patch.object(helper, "_build_instructions", wraps=helper._build_instructions) as build_mock:
+            first = helper._current_instructions()
+            helper.configure_session_context(safe_mode_enabled=True, strict_safe_mode=False)
+            self.assertIs(helper._current_instructions(), first)
+            helper.configure_session_context(strict_safe_mode=True)
+            self.assertIn("strict safe mode is ON", helper._current_instructions())
+
+        self.assertEqual(build_mock.call_count, 2)
+        self.assertNotIn("instructions", helper._base_request)
+
+    def test_extract_function_calls_reads_dict_and_object_items(self):
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}, clear=False):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=types.SimpleNamespace()):
+                helper = OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+
+        dict_response = {
+            "output": [
+                {"type": "message", "id": "msg_1"},
+                {"type": "function_call", "name": "get_commands", "arguments": "{}", "id": "item_1"},
+            ]
+        }
+        object_response = types.SimpleNamespace(
+            output=[types.SimpleNamespace(type="function_call", name="get_commands", call_id="call_1")]
+        )
+
+        self.assertEqual(
+            helper._extract_function_calls(dict_response),
+            [{"name": "get_commands", "arguments": "{}", "call_id": "item_1"}],
+        )
+        self.assertEqual(
+            helper._extract_function_calls(object_response),
+            [{"name": "get_commands", "arguments": "{}", "call_id": "call_1"}],
+        )
+        self.assertEqual(helper._extract_function_calls(types.SimpleNamespace(output=None)), [])
+
+        plain_response = types.SimpleNamespace(output=[types.SimpleNamespace(type="message")])
+        self.assertEqual(helper._resolve_function_calls(plain_response), (plain_response, None))
+
+    def test_client_keeps_idle_connections_between_turns(self):
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}, clear=False):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=types.SimpleNamespace()) as openai_mock:
+                OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+
+        http_client = openai_mock.call_args.kwargs["http_client"]
+        self.assertIsInstance(http_client, httpx.Client)
+        http_client.close()
+
+    def test_client_retry_and_timeout_settings_come_from_environment(self):
+        environment = {
+            "OPENAI_API_KEY": "test-key",
+            "PROMPT2SHELL_API_MAX_RETRIES": "7",
+            "PROMPT2SHELL_API_TIMEOUT": "invalid",
+        }
+        with mock.patch.dict(os.environ, environment, clear=False):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=types.SimpleNamespace()) as openai_mock:
+                OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+
+        client_kwargs = openai_mock.call_args.kwargs
+        self.assertEqual(client_kwargs["max_retries"], 7)
+        self.assertEqual(client_kwargs["timeout"], 120.0)
+        client_kwargs["http_client"].close()
+
+    def test_sanitize_commands_payload_drops_malformed_commands(self):
+        payload = {
+            "commands": [
+                {"command": "ls", "description": "List"},
+                {"command": "   "},
+                {"command": 42},
+                "pwd",
+                {"command": "df -h", "description": None},
+            ],
+            "response": None,
+        }
+
+        self.assertEqual(
+            OpenAIHelper._sanitize_commands_payload(payload),
+            {
+                "commands": [
+                    {"command": "ls", "description": "List"},
+                    {"command": "df -h", "description": ""},
+                ],
+                "response": "",
+            },
+        )
+        self.assertIsNone(OpenAIHelper._sanitize_commands_payload({"commands": "ls"}))
+        self.assertIsNone(OpenAIHelper._sanitize_commands_payload(["ls"]))
+
+    def test_format_usage_line_reports_last_and_session_usage(self):
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}, clear=False):
+            with mock.patch("prompt2shell.openai_helper.OpenAI", return_value=types.SimpleNamespace()):
+                helper = OpenAIHelper(model_name="gpt-test", max_output_tokens=200)
+
+        self.assertIsNone(helper.format_usage_line())
+
+        helper._begin_usage_capture()
+        helper._record_usage_summary(UsageSummary(input_tokens=10, output_tokens=20, total_tokens=30, api_calls=1))
+        helper._finish_usage_capture()
+
+        self.assertEqual(
+            helper.format_usage_line(),
+            "Tokens last: in=10, out=20, total=30, out_left=180/200 | session: in=10, out=20, total=30, calls=1",
+        )
+        session = helper.get_session_usage_summary()
+        self.assertEqual(session, {"input_tokens": 10, "output_tokens": 20, "total_tokens": 30, "api_calls": 1})
+        session["api_calls"] = 99
+        self.assertEqual(helper.session_usage_summary.api_calls, 1)
 
 
 if __name__ == "__main__":